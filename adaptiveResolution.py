@@ -0,0 +1,50 @@
+# Adaptive render resolution
+# Watches recent frame times and steps the internal render resolution down
+# when frames run over budget and back up when there is room to spare
+
+from collections import deque
+
+# Quality levels from best to cheapest as (scale, rectWidth). scale shrinks
+# both internal dimensions so the image keeps its shape when it is
+# upscaled to the window, and rectWidth widens each ray column.
+LEVELS = [(1.0, 1), (1.0, 2), (0.75, 2), (0.5, 2), (0.5, 4)]
+
+class ResolutionGovernor:
+	def __init__(self, targetFps, levels = LEVELS, window = 30, headroom = 0.7, hold = 120):
+		# Frame budget in seconds
+		self.budget = 1.0 / targetFps
+		self.levels = levels
+		# Frames averaged before any change, and the fraction of the budget
+		# the average must fall under before stepping back up. The gap
+		# between headroom and the full budget is the hysteresis band.
+		self.window = window
+		self.headroom = headroom
+		# Frames a level stays barred after it ran over budget, doubled
+		# each time it runs over again so a level that only just misses is
+		# not retried over and over
+		self.holds = [hold] * len(levels)
+		self.level = 0
+		self.times = deque(maxlen = window)
+		self.frames = 0
+		# Frame from which each level may be tried again
+		self.barred = [0] * len(levels)
+
+	def update(self, frameTime):
+		# Record a frame time. Returns the new (scale, rectWidth) when the
+		# level changes, otherwise None.
+		self.frames += 1
+		self.times.append(frameTime)
+		if len(self.times) < self.window:
+			return None
+		average = sum(self.times) / len(self.times)
+		if average > self.budget and self.level < len(self.levels) - 1:
+			self.barred[self.level] = self.frames + self.holds[self.level]
+			self.holds[self.level] *= 2
+			self.level += 1
+		elif average < self.budget * self.headroom and self.level > 0 and self.frames >= self.barred[self.level - 1]:
+			self.level -= 1
+		else:
+			return None
+		# Judge the new level on its own frames only
+		self.times.clear()
+		return self.levels[self.level]
@@ -0,0 +1,46 @@
+# Time based animation
+# Frame sets are kept flattened in one array, and each animated thing only
+# stores which set it plays and when it started. Its frame is worked out
+# from the time when it is about to be drawn, so nothing is stepped for
+# things that are off screen and the speed does not depend on the frame
+# rate.
+
+import math
+from array import array
+
+# Frames shown per second, one per game step as before
+RATE = 30.0
+# A time a whole number of frames after the start shows that frame despite
+# rounding
+EPSILON = 1e-6
+
+class FrameSets:
+	# Set i is frames[offsets[i]:offsets[i + 1]]
+	def __init__(self, frameSets = (), rate = RATE):
+		self.rate = float(rate)
+		self.offsets = array("i", [0])
+		self.frames = array("i")
+		# Index of every set by its frames, so equal sets are stored once
+		self.sets = {}
+		for frameSet in frameSets:
+			self.add(frameSet)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def add(self, frames):
+		# Index of the set playing frames, added if it is new
+		key = tuple(int(frame) for frame in frames)
+		i = self.sets.get(key)
+		if i is None:
+			i = len(self)
+			self.sets[key] = i
+			self.frames.extend(key)
+			self.offsets.append(len(self.frames))
+		return i
+
+	def frame(self, i, elapsed):
+		# Frame of set i shown elapsed seconds after it started
+		first = self.offsets[i]
+		count = self.offsets[i + 1] - first
+		return self.frames[first + int(math.floor(elapsed * self.rate + EPSILON)) % count]
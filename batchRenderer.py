@@ -0,0 +1,145 @@
+# Batched off screen rendering
+# Renders many camera poses over one loaded map and returns the views as
+# NumPy arrays, without opening a window. The map, textures, wall
+# structures and caches are loaded once and shared by every pose, e.g.
+#   renderer = batchRenderer.BatchRenderer("test.rcm", 160, 120)
+#   frames = renderer.render([(0, 0, 0, 0.25 * math.pi), (2, 1, 1.5, 0.25 * math.pi)])
+#   depth, texture = renderer.columns(poses)
+# or from the command line, to measure throughput:
+#   python batchRenderer.py --map test.rcm --count 500 --output views.npy
+
+import sys
+import math
+import random
+import argparse
+import timeit
+import numpy
+import pygame
+import raycasting10
+import entityStore
+
+class BatchRenderer:
+	# Poses are (x, y, angle, fov) with angles in radians
+	def __init__(self, mapName, width = 320, height = 240, rectWidth = 1, options = None, background = "rcBackground.PNG", clip = 30):
+		if options is None:
+			options = parseOptions([])
+		self.width = width
+		self.height = height
+		self.clip = clip
+
+		sprImages = []
+		textures = []
+		frameSets = []
+		lines = []
+		regions = []
+		sprites = []
+		dynamicLines = []
+		compiled = raycasting10.loadMap(mapName, sprImages, textures, lines, regions, sprites, frameSets, dynamicLines)
+		# Dynamic walls stay where the map puts them
+		lines.extend(dynamicLines)
+		for image in sprImages:
+			image.set_colorkey((255, 0, 255))
+
+		self.entities = entityStore.EntityStore()
+		raycasting10.loadEntities(self.entities, sprites, compiled)
+		self.collision = raycasting10.loadCollision(regions, compiled)
+
+		# Every pose is drawn into this surface and copied out
+		self.target = pygame.Surface((width, height), 0, 32)
+		self.renderer = raycasting10.Renderer(width, height, rectWidth, textures, sprImages, lines, pygame.image.load(background), options, None, compiled)
+		self.renderer.setVisibility(self.collision, raycasting10.loadVisRegions(compiled))
+		# Ray columns per view
+		self.resWidth = self.renderer.resWidth
+
+	def camera(self, pose):
+		x, y, angle, fov = pose
+		return raycasting10.Player(x, y, angle % (2 * math.pi), fov, self.clip)
+
+	def render(self, poses, time = 0.0, out = None):
+		# Views of poses as RGB bytes in an array of shape
+		# (len(poses), height, width, 3), written into out if given.
+		# Animations are shown at game time time.
+		if out is None:
+			out = numpy.empty((len(poses), self.height, self.width, 3), numpy.uint8)
+		for k, pose in enumerate(poses):
+			self.renderer.renderFrame(self.target, self.camera(pose), self.entities, 1.0, time)
+			# The view locks the surface, so it is dropped before the next pose
+			pixels = pygame.surfarray.pixels3d(self.target)
+			out[k] = pixels.transpose(1, 0, 2)
+			del pixels
+		return out
+
+	def columns(self, poses, time = 0.0):
+		# The nearest wall in every ray column of poses as two arrays of
+		# shape (len(poses), resWidth): the distance along the ray, inf
+		# where nothing is hit within the clip distance, and the texture
+		# index, -1 where nothing is hit. Nothing is drawn.
+		renderer = self.renderer
+		caster = renderer.caster
+		depth = numpy.full((len(poses), self.resWidth), numpy.inf)
+		texture = numpy.full((len(poses), self.resWidth), -1, numpy.int32)
+		for k, pose in enumerate(poses):
+			player = self.camera(pose)
+			renderer.selectWalls(player)
+			poseDepth = depth[k]
+			poseTexture = texture[k]
+			# Casters that keep every hit in a column list them in any order
+			for hit in caster.cast(player, self.resWidth, renderer.screenWidth):
+				column = hit[3]
+				if hit[0] < poseDepth[column]:
+					poseDepth[column] = hit[0]
+					poseTexture[column] = renderer.textureFrame(hit[1], time)
+		return depth, texture
+
+	def randomPoses(self, count, fov = 0.25 * math.pi, seed = None):
+		# count poses at random points inside the map's collision regions
+		generator = random.Random(seed)
+		collision = self.collision
+		if collision.count == 0:
+			return []
+		maxX = collision.minX + collision.width * collision.cellSize
+		maxY = collision.minY + collision.height * collision.cellSize
+		poses = []
+		while len(poses) < count:
+			x = generator.uniform(collision.minX, maxX)
+			y = generator.uniform(collision.minY, maxY)
+			if self.collision.region(x, y) >= 0:
+				poses.append((x, y, generator.uniform(0, 2 * math.pi), fov))
+		return poses
+
+def parseOptions(args = None):
+	parser = argparse.ArgumentParser(description = "Render random camera poses off screen and report the throughput")
+	parser.add_argument("--map", default = "test.map", help = "map file to load")
+	parser.add_argument("--count", type = int, default = 200, help = "poses to render")
+	parser.add_argument("--batch", type = int, default = 50, help = "poses per render call")
+	parser.add_argument("--width", type = int, default = 160, help = "view width in pixels")
+	parser.add_argument("--height", type = int, default = 120, help = "view height in pixels")
+	parser.add_argument("--rect-width", dest = "rectWidth", type = int, default = 1, help = "pixels per ray column")
+	parser.add_argument("--fov", type = float, default = 0.25, help = "field of view as a fraction of pi")
+	parser.add_argument("--seed", type = int, default = 0, help = "random seed for the poses")
+	parser.add_argument("--columns", action = "store_true", help = "only cast the per column depth and texture buffers")
+	parser.add_argument("--output", help = "save the frames, or the depth buffers with --columns, to this .npy file")
+	raycasting10.addEngineOptions(parser)
+	parser.set_defaults(engine = "numpy")
+	return parser.parse_args(args)
+
+def main():
+	options = parseOptions()
+	renderer = BatchRenderer(options.map, options.width, options.height, options.rectWidth, options)
+	poses = renderer.randomPoses(options.count, options.fov * math.pi, options.seed)
+	batches = []
+	start = timeit.default_timer()
+	for first in range(0, len(poses), options.batch):
+		batch = poses[first:first + options.batch]
+		if options.columns:
+			batches.append(renderer.columns(batch)[0])
+		else:
+			batches.append(renderer.render(batch))
+	elapsed = timeit.default_timer() - start
+	renderer.renderer.close()
+	sys.stdout.write("%d views in %.2f s, %.1f views per second\n" % (len(poses), elapsed, len(poses) / elapsed))
+	if options.output and batches:
+		numpy.save(options.output, numpy.concatenate(batches))
+
+if __name__ == "__main__":
+	main()
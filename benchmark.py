@@ -0,0 +1,206 @@
+# Headless benchmark for the ray casting engine
+# Plays scripted camera paths through a map without a window and reports
+# frame times, e.g.
+#   python benchmark.py --path tour --frames 300 --output results.json
+
+import os
+import sys
+import json
+import math
+import argparse
+import platform
+import timeit
+
+# Must be set before pygame creates a display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import raycasting10
+import bitmapFont
+import entityStore
+
+# Camera keyframes as (t, x, y, angle) with t running from 0 to 1
+PATHS = {
+	# Stand in the middle of the central room and turn around once
+	"spin": [(0.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 2 * math.pi)],
+	# Walk west down the corridor, then south into the corner room and
+	# look around it
+	"tour": [
+		(0.0, 0.0, 0.0, math.pi),
+		(0.3, -6.0, 0.0, math.pi),
+		(0.45, -6.0, -3.0, 1.5 * math.pi),
+		(0.7, -5.5, -6.5, 1.25 * math.pi),
+		(1.0, -5.5, -6.5, 3.25 * math.pi)],
+}
+
+def loadPath(name):
+	# A built in path name or a JSON file holding [[t, x, y, angle], ...]
+	if name in PATHS:
+		return PATHS[name]
+	pathFile = open(name, "r")
+	keyframes = [tuple(float(value) for value in keyframe) for keyframe in json.load(pathFile)]
+	pathFile.close()
+	return keyframes
+
+def cameraAt(keyframes, t):
+	# Linear interpolation of (x, y, angle) between keyframes
+	if t <= keyframes[0][0]:
+		return keyframes[0][1:]
+	i = 1
+	while i < len(keyframes):
+		if t <= keyframes[i][0]:
+			first = keyframes[i - 1]
+			last = keyframes[i]
+			span = last[0] - first[0]
+			f = 0.0
+			if span > 0:
+				f = (t - first[0]) / span
+			return tuple(first[k] + (last[k] - first[k]) * f for k in (1, 2, 3))
+		i += 1
+	return keyframes[-1][1:]
+
+def percentile(values, p):
+	# Nearest rank percentile of an unsorted list
+	ordered = sorted(values)
+	if not ordered:
+		return 0.0
+	rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+	return ordered[min(len(ordered) - 1, max(0, rank))]
+
+def summarize(values):
+	# Milliseconds
+	if not values:
+		return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+	return {
+		"mean": 1000.0 * sum(values) / len(values),
+		"p50": 1000.0 * percentile(values, 50),
+		"p95": 1000.0 * percentile(values, 95),
+		"p99": 1000.0 * percentile(values, 99)}
+
+def run(options):
+	pygame.init()
+	screen = pygame.display.set_mode((options.width, options.height))
+	background = pygame.image.load("rcBackground.PNG")
+
+	sprImages = []
+	textures = []
+	frameSets = []
+	lines = []
+	regions = []
+	sprites = []
+	dynamicLines = []
+	loadTime = timeit.default_timer()
+	compiled = raycasting10.loadMap(options.map, sprImages, textures, lines, regions, sprites, frameSets, dynamicLines)
+	loadTime = timeit.default_timer() - loadTime
+	# Dynamic walls stay where the map puts them
+	lines.extend(dynamicLines)
+	for image in sprImages:
+		image.set_colorkey((255, 0, 255))
+
+	player = raycasting10.Player(0, 0, 0, options.fov * math.pi, 30)
+	entities = entityStore.EntityStore()
+	raycasting10.loadEntities(entities, sprites, compiled)
+	renderer = raycasting10.Renderer(options.width, options.height, options.rectWidth, textures, sprImages, lines, background, options, None, compiled)
+	renderer.setVisibility(raycasting10.loadCollision(regions, compiled), raycasting10.loadVisRegions(compiled))
+	keyframes = loadPath(options.path)
+
+	profiler = renderer.profiler
+	# The stage overlay the game shows with F3, drawn over every frame
+	font = None
+	if options.overlay:
+		font = bitmapFont.BitmapFont("zmfont.bmp", 8, 8)
+		profiler.toggle()
+	frameTimes = []
+	stageTimes = {}
+	counters = {}
+	frame = -options.warmup
+	while frame < options.frames:
+		t = 0.0
+		if options.frames > 1:
+			t = max(0, frame) / float(options.frames - 1)
+		player.x, player.y, player.angle = cameraAt(keyframes, t)
+		player.angle %= 2 * math.pi
+
+		profiler.beginFrame()
+		renderer.renderFrame(screen, player, entities)
+		if font is not None:
+			profiler.draw(font, screen, 0, 0)
+			profiler.lap("hud")
+		pygame.display.flip()
+		profiler.lap("flip")
+		profiler.endFrame()
+		renderer.adapt(profiler.frameTime)
+
+		if frame >= 0:
+			frameTimes.append(profiler.frameTime)
+			for stage in profiler.times:
+				stageTimes.setdefault(stage, []).append(profiler.times[stage])
+			for name in profiler.counters:
+				counters[name] = counters.get(name, 0) + profiler.counters[name]
+		frame += 1
+
+	results = {
+		"map": options.map,
+		"path": options.path,
+		"engine": options.engine,
+		"compose": options.compose,
+		"width": options.width,
+		"height": options.height,
+		"rectWidth": options.rectWidth,
+		"workers": options.workers,
+		"targetFps": options.targetFps,
+		# Internal resolution at the end of the run
+		"view": profiler.labels.get("view", ""),
+		"frames": options.frames,
+		"label": options.label,
+		"python": platform.python_version(),
+		"pygame": pygame.version.ver,
+		"loadSeconds": loadTime,
+		"frameMs": summarize(frameTimes),
+		"stageMs": dict((stage, summarize(stageTimes[stage])) for stage in stageTimes),
+		# Mean per frame
+		"counters": dict((name, counters[name] / float(max(1, len(frameTimes)))) for name in counters),
+	}
+	renderer.close()
+	pygame.quit()
+	return results
+
+def report(results, out):
+	frameMs = results["frameMs"]
+	out.write("%s %s/%s %dx%d, %d workers, %d frames\n" % (results["path"], results["engine"], results["compose"], results["width"], results["height"], results["workers"], results["frames"]))
+	out.write("frame  mean %7.2f  p50 %7.2f  p95 %7.2f  p99 %7.2f ms\n" % (frameMs["mean"], frameMs["p50"], frameMs["p95"], frameMs["p99"]))
+	for stage in sorted(results["stageMs"]):
+		stageMs = results["stageMs"][stage]
+		out.write("%-8s mean %7.2f  p95 %7.2f ms\n" % (stage, stageMs["mean"], stageMs["p95"]))
+	out.write("view     %s\n" % (results["view"],))
+	for name in sorted(results["counters"]):
+		out.write("%-8s %10.1f per frame\n" % (name, results["counters"][name]))
+
+def parseOptions(args = None):
+	parser = argparse.ArgumentParser(description = "Headless ray casting benchmark")
+	parser.add_argument("--map", default = "test.map", help = "map file to load")
+	parser.add_argument("--path", default = "tour", help = "camera path: %s or a JSON keyframe file" % ", ".join(sorted(PATHS)))
+	parser.add_argument("--frames", type = int, default = 200, help = "frames to time")
+	parser.add_argument("--warmup", type = int, default = 10, help = "untimed frames rendered first")
+	parser.add_argument("--width", type = int, default = 320, help = "render width in pixels, the most when --target-fps is set")
+	parser.add_argument("--height", type = int, default = 240, help = "render height in pixels, the most when --target-fps is set")
+	parser.add_argument("--rect-width", dest = "rectWidth", type = int, default = 1, help = "pixels per ray column")
+	parser.add_argument("--fov", type = float, default = 0.25, help = "field of view as a fraction of pi")
+	parser.add_argument("--label", default = "", help = "free text stored with the results, e.g. a commit id")
+	parser.add_argument("--output", help = "write the results as JSON to this file")
+	parser.add_argument("--overlay", action = "store_true", help = "draw the profiler overlay on every frame, as the game does with F3")
+	raycasting10.addEngineOptions(parser)
+	return parser.parse_args(args)
+
+def main():
+	options = parseOptions()
+	results = run(options)
+	report(results, sys.stdout)
+	if options.output:
+		outFile = open(options.output, "w")
+		json.dump(results, outFile, indent = 2, sort_keys = True)
+		outFile.close()
+
+if __name__ == "__main__":
+	main()
@@ -1,27 +1,56 @@
 import pygame
+from collections import OrderedDict
 
 class BitmapFont:
 
-	def __init__(self, image, width, height, subWidth = 16, subHeight = 8, length = 128):
+	def __init__(self, image, width, height, subWidth = 16, subHeight = 8, length = 128, cacheSize = 256):
 		self.image = pygame.image.load(image)
 		self.width = width
 		self.height = height
 		self.subWidth = subWidth
 		self.subHeight = subHeight
 		self.length = length
-		self.curColor = (255, 255, 255)
+		# Colour of the glyphs in the font image
+		self.glyphColor = (255, 255, 255)
+		# The font image recoloured for each text colour used so far
+		self.atlases = {}
+		# Recently printed strings, keyed by (text, colour), most recent last
+		self.cacheSize = cacheSize
+		self.rendered = OrderedDict()
+		
+	def atlas(self, color):
+		atlas = self.atlases.get(color)
+		if atlas is None:
+			atlas = self.image.copy()
+			tempArray = pygame.PixelArray(atlas)
+			tempArray.replace(self.glyphColor, color)
+			del tempArray
+			self.atlases[color] = atlas
+		return atlas
+		
+	def glyphRect(self, char):
+		if ord(char) < self.length:
+			return pygame.Rect((ord(char) % self.subWidth) * self.width, (ord(char) // self.subWidth) * self.height, self.width, self.height)
+		return pygame.Rect(105, 42, self.width, self.height)
+		
+	def render(self, s, color = (255, 255, 255)):
+		# s as one surface, drawn once and reused while it stays cached
+		key = (s, tuple(color))
+		surface = self.rendered.pop(key, None)
+		if surface is None:
+			atlas = self.atlas(key[1])
+			surface = pygame.Surface((len(s) * self.width, self.height), 0, atlas)
+			x = 0
+			for char in s:
+				surface.blit(atlas, (x, 0), self.glyphRect(char))
+				x += self.width
+			if len(self.rendered) >= self.cacheSize:
+				self.rendered.popitem(last = False)
+		self.rendered[key] = surface
+		return surface
 		
 	def bitmapPrint(self, target, x, y, s, color = (255, 255, 255)):
-		tempArray = pygame.PixelArray(self.image)
-		tempArray.replace(self.curColor, color)
-		self.curColor = color
-		newImage = tempArray.make_surface()
-		for char in s:
-			if ord(char) < self.length:
-				target.blit(newImage, (x, y), pygame.Rect((ord(char) % self.subWidth) * self.width, (ord(char) / self.subWidth) * self.height, self.width, self.height))
-			else:
-				target.blit(newImage, (x, y), pygame.Rect(105, 42, self.width, self.height))
-			x += self.width
+		target.blit(self.render(s, color), (x, y))
 
 def main():
 	clock = pygame.time.Clock()
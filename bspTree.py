@@ -0,0 +1,236 @@
+# Binary space partition over the walls of a WallStore
+# Built once at map load, walked front to back from the camera so each
+# column stops at its first opaque hit
+
+import rays
+
+EPSILON = 1e-9
+
+class BSPFragment:
+	# Part of a wall that ended up in one node. The hit is always solved
+	# against the original wall so texture coordinates are unchanged, then
+	# checked against the fragment's span s0..s1 along it.
+	def __init__(self, walls, wall, s0, s1):
+		# Index of the wall in the tree's WallStore
+		self.wall = wall
+		self.s0 = s0
+		self.s1 = s1
+		self.x1 = walls.x1[wall]
+		self.y1 = walls.y1[wall]
+		self.dx = walls.dx[wall]
+		self.dy = walls.dy[wall]
+		self.lengthSq = self.dx**2 + self.dy**2
+
+	def point(self, s):
+		return (self.x1 + self.dx * s, self.y1 + self.dy * s)
+
+	def contains(self, x, y):
+		if self.lengthSq == 0:
+			return 1
+		s = ((x - self.x1) * self.dx + (y - self.y1) * self.dy) / self.lengthSq
+		return s >= self.s0 - EPSILON and s <= self.s1 + EPSILON
+
+class BSPNode:
+	def __init__(self, fragment):
+		# Partition line through the splitter fragment
+		self.px, self.py = fragment.point(fragment.s0)
+		self.dx = fragment.dx
+		self.dy = fragment.dy
+		self.fragments = [fragment]
+		self.front = None
+		self.back = None
+
+	def side(self, x, y):
+		# > 0 in front (left of the partition direction), < 0 behind
+		return self.dx * (y - self.py) - self.dy * (x - self.px)
+
+	def crosses(self, ray, side):
+		# True if the ray reaches the partition line before the clip distance
+		rate = self.dx * ray.sinAngle - self.dy * ray.cosAngle
+		if rate == 0:
+			return 0
+		t = -side / rate
+		return t >= -EPSILON and t <= ray.clip + EPSILON
+
+class BSPTree:
+	def __init__(self, walls, candidates = 8):
+		self.walls = walls
+		self.candidates = candidates
+		self.nodeCount = 0
+		self.splits = 0
+		# Walls tested by trace since the counter was last reset
+		self.tested = 0
+		# Walls taken out of the tree after they moved, tested by every trace
+		self.loose = []
+		self.root = self.build([BSPFragment(walls, i, 0.0, 1.0) for i in range(len(walls))])
+
+	def chooseSplitter(self, fragments):
+		# Score a few evenly spaced candidates on splits and balance
+		step = max(1, len(fragments) // self.candidates)
+		best = None
+		bestScore = None
+		i = 0
+		while i < len(fragments):
+			node = BSPNode(fragments[i])
+			front = 0
+			back = 0
+			splits = 0
+			for fragment in fragments:
+				a = node.side(*fragment.point(fragment.s0))
+				b = node.side(*fragment.point(fragment.s1))
+				if a > EPSILON and b < -EPSILON or a < -EPSILON and b > EPSILON:
+					splits += 1
+				elif a > EPSILON or b > EPSILON:
+					front += 1
+				elif a < -EPSILON or b < -EPSILON:
+					back += 1
+			score = splits * 8 + abs(front - back)
+			if bestScore is None or score < bestScore:
+				best = i
+				bestScore = score
+			i += step
+		return best
+
+	def partition(self, node, fragments):
+		front = []
+		back = []
+		for fragment in fragments:
+			a = node.side(*fragment.point(fragment.s0))
+			b = node.side(*fragment.point(fragment.s1))
+			if abs(a) <= EPSILON and abs(b) <= EPSILON:
+				node.fragments.append(fragment)
+			elif a >= -EPSILON and b >= -EPSILON:
+				front.append(fragment)
+			elif a <= EPSILON and b <= EPSILON:
+				back.append(fragment)
+			else:
+				# Split where the fragment crosses the partition line
+				s = fragment.s0 + (fragment.s1 - fragment.s0) * (a / (a - b))
+				first = BSPFragment(self.walls, fragment.wall, fragment.s0, s)
+				second = BSPFragment(self.walls, fragment.wall, s, fragment.s1)
+				if a > 0:
+					front.append(first)
+					back.append(second)
+				else:
+					back.append(first)
+					front.append(second)
+				self.splits += 1
+		return front, back
+
+	def build(self, fragments):
+		# Iterative so large, badly balanced maps don't hit the recursion limit
+		if len(fragments) == 0:
+			return None
+		root = None
+		stack = [(fragments, None, 0)]
+		while stack:
+			fragments, parent, isBack = stack.pop()
+			splitter = fragments.pop(self.chooseSplitter(fragments))
+			node = BSPNode(splitter)
+			self.nodeCount += 1
+			front, back = self.partition(node, fragments)
+			if parent is None:
+				root = node
+			elif isBack:
+				parent.back = node
+			else:
+				parent.front = node
+			if front:
+				stack.append((front, node, 0))
+			if back:
+				stack.append((back, node, 1))
+		return root
+
+	def move(self, i, line):
+		# Give wall i line's position and texture. The tree is never built
+		# again: a wall's fragments are dropped from it the first time it
+		# moves and from then on it is tested on its own.
+		if i not in self.loose:
+			stack = [self.root]
+			while stack:
+				node = stack.pop()
+				if node is not None:
+					node.fragments = [fragment for fragment in node.fragments if fragment.wall != i]
+					stack.append(node.front)
+					stack.append(node.back)
+			self.loose.append(i)
+		self.walls.set(i, line)
+
+	def trace(self, ray):
+		# Walk front to back and return the first hit as
+		# (distance, texture, texVert, x, y), or None. Loose walls are tested
+		# first, and the walk is clipped at the nearest of their hits.
+		walls = self.walls
+		loose = None
+		for i in self.loose:
+			hit = walls.hit(i, ray)
+			if hit is not None and (loose is None or hit[0] < loose[0]):
+				loose = hit
+		tested = len(self.loose)
+		if loose is not None:
+			ray = rays.Ray(ray.x, ray.y, ray.cosAngle, ray.sinAngle, loose[0])
+		stack = [self.root]
+		while stack:
+			item = stack.pop()
+			if item is None:
+				continue
+			if item.__class__ is BSPNode:
+				side = item.side(ray.x, ray.y)
+				if side >= 0:
+					near, far = item.front, item.back
+				else:
+					near, far = item.back, item.front
+				if far is not None and item.crosses(ray, side):
+					stack.append(far)
+				stack.append(item.fragments)
+				stack.append(near)
+			else:
+				nearest = None
+				for fragment in item:
+					tested += 1
+					hit = walls.hit(fragment.wall, ray)
+					if hit is not None and fragment.contains(hit[3], hit[4]):
+						if nearest is None or hit[0] < nearest[0]:
+							nearest = hit
+				if nearest is not None:
+					self.tested += tested
+					return nearest
+		self.tested += tested
+		return loose
+
+class BSPCaster:
+	# Wall engine that traces each column through a BSPTree
+	def __init__(self, walls):
+		# Column tables of the last cast
+		self.tables = None
+		# Rays cast and walls tested by the last cast
+		self.rays = 0
+		self.tested = 0
+		self.tree = BSPTree(walls)
+
+	def setVisible(self, visible):
+		# Traces only reach walls near each ray already, so a visible set
+		# would not save any tests
+		pass
+
+	def moveWall(self, i, line):
+		self.tree.move(i, line)
+
+	def cast(self, player, resWidth, screenWidth):
+		return self.castRange(player, resWidth, screenWidth, 0, resWidth)
+
+	def castRange(self, player, resWidth, screenWidth, first, last):
+		# Columns first to last - 1 only
+		screenLineIndex = []
+		self.tree.tested = 0
+		self.rays = int(last - first)
+		tables = self.tables = rays.columnTables(self.tables, player, resWidth, screenWidth)
+		xs, ys = tables.directions(player, first, last)
+		for divCount, dirX, dirY in zip(range(first, last), xs, ys):
+			hit = self.tree.trace(rays.Ray(player.x, player.y, dirX, dirY, player.clip))
+			if hit is not None:
+				rectHeight = tables.height(divCount, hit[0])
+				screenLineIndex.append((hit[0], hit[1], rectHeight, divCount, hit[2]))
+
+		self.tested = self.tree.tested
+		return screenLineIndex
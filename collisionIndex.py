@@ -0,0 +1,152 @@
+# Spatial index over collision region triangles
+# Keeps every triangle's edges as flat arrays of edge functions and buckets
+# the triangles in a uniform grid, so a point query only tests the few
+# triangles near the point
+
+import math
+from array import array
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def triangleSides(points):
+	# Sides of a triangle as (vert, neg, m, b): the line y = m * x + b, or
+	# x = b when vert, with neg set when the inside is below it, or left of
+	# it when vert
+	sides = []
+	for i in range(3):
+		m = 0
+		b = 0
+		vert = 0
+		neg = 0
+		nextIndex = (i + 1) % 3
+		other = i - 1
+		if points[i][0] == points[nextIndex][0]:
+			vert = 1
+			b = points[i][0]
+			if points[other][0] < points[i][0]:
+				neg = 1
+		else:
+			m = float(points[i][1] - points[nextIndex][1])/float(points[i][0] - points[nextIndex][0])
+			b = float(points[i][1] - (m * points[i][0]))
+			if points[other][1] < (m * points[other][0] + b):
+				neg = 1
+		sides.append((vert, neg, m, b))
+	return sides
+
+class RegionIndex:
+	# Each triangle side is stored as (a, b, c) with the point inside when
+	# (a * x + c) + b * y >= 0. This is the same sum, in the same order, as
+	# the comparisons in Triangle.isInside, so points on an edge land the
+	# same way.
+	def __init__(self, regions, cellSize = 1.0):
+		self.build([(regionIndex, triangle.points) for regionIndex, region in enumerate(regions) for triangle in region.triangles], cellSize)
+
+	def build(self, triangles, cellSize):
+		# triangles are (region index, corner points) in region order
+		self.cellSize = float(cellSize)
+		self.edges = array("d")
+		self.owner = array("i")
+		bounds = []
+		for regionIndex, points in triangles:
+			for vert, neg, m, b in triangleSides(points):
+				if vert:
+					if neg:
+						self.edges.extend((-1.0, 0.0, b))
+					else:
+						self.edges.extend((1.0, 0.0, -b))
+				elif neg:
+					self.edges.extend((m, -1.0, b))
+				else:
+					self.edges.extend((-m, 1.0, -b))
+			self.owner.append(regionIndex)
+			xs = [point[0] for point in points]
+			ys = [point[1] for point in points]
+			bounds.append((min(xs), min(ys), max(xs), max(ys)))
+		self.count = len(self.owner)
+
+		if bounds:
+			self.minX = min(bound[0] for bound in bounds)
+			self.minY = min(bound[1] for bound in bounds)
+			self.width = int(math.floor((max(bound[2] for bound in bounds) - self.minX) / self.cellSize)) + 1
+			self.height = int(math.floor((max(bound[3] for bound in bounds) - self.minY) / self.cellSize)) + 1
+		else:
+			self.minX = self.minY = 0.0
+			self.width = self.height = 0
+		# Triangles whose bounding box touches each cell, in region order
+		self.cells = [[] for i in range(self.width * self.height)]
+		for triangle, (x0, y0, x1, y1) in enumerate(bounds):
+			cx0, cy0 = self.cell(x0, y0)
+			cx1, cy1 = self.cell(x1, y1)
+			for cy in range(cy0, cy1 + 1):
+				for cx in range(cx0, cx1 + 1):
+					self.cells[cy * self.width + cx].append(triangle)
+		self.table = None
+
+	def cell(self, x, y):
+		# Cell coordinates of a point, clamped to the grid
+		cx = int(math.floor((x - self.minX) / self.cellSize))
+		cy = int(math.floor((y - self.minY) / self.cellSize))
+		return min(self.width - 1, max(0, cx)), min(self.height - 1, max(0, cy))
+
+	def contains(self, triangle, x, y):
+		edges = self.edges
+		k = triangle * 9
+		return (edges[k] * x + edges[k + 2]) + edges[k + 1] * y >= 0 and (edges[k + 3] * x + edges[k + 5]) + edges[k + 4] * y >= 0 and (edges[k + 6] * x + edges[k + 8]) + edges[k + 7] * y >= 0
+
+	def region(self, x, y):
+		# Index of the first region containing the point, or -1
+		if self.count == 0:
+			return -1
+		# Points off the grid are clamped to an edge cell, whose triangles
+		# then reject them
+		cx, cy = self.cell(x, y)
+		for triangle in self.cells[cy * self.width + cx]:
+			if self.contains(triangle, x, y):
+				return self.owner[triangle]
+		return -1
+
+	def isInside(self, x, y):
+		return self.region(x, y) != -1
+
+	def regionsAt(self, xs, ys):
+		# Batched region(): one region index per point, -1 for none. Uses
+		# NumPy arrays when NumPy is installed, otherwise plain lists.
+		if numpy is None or self.count == 0:
+			return [self.region(x, y) for x, y in zip(xs, ys)]
+		if self.table is None:
+			# Padded (cells, most triangles in a cell) table, -1 for padding
+			depth = max(1, max(len(cell) for cell in self.cells))
+			self.table = numpy.full((len(self.cells), depth), -1, dtype = numpy.int64)
+			for i, cell in enumerate(self.cells):
+				self.table[i, :len(cell)] = cell
+			self.edgeArray = numpy.frombuffer(self.edges, dtype = numpy.float64).reshape(self.count, 3, 3)
+			self.ownerArray = numpy.frombuffer(self.owner, dtype = numpy.int32)
+		xs = numpy.asarray(xs, dtype = numpy.float64)
+		ys = numpy.asarray(ys, dtype = numpy.float64)
+		cx = numpy.floor((xs - self.minX) / self.cellSize).astype(numpy.int64)
+		cy = numpy.floor((ys - self.minY) / self.cellSize).astype(numpy.int64)
+		cx = numpy.clip(cx, 0, self.width - 1)
+		cy = numpy.clip(cy, 0, self.height - 1)
+		candidates = self.table[cy * self.width + cx]
+		edges = self.edgeArray[numpy.maximum(candidates, 0)]
+		inside = ((edges[..., 0] * xs[:, None, None] + edges[..., 2]) + edges[..., 1] * ys[:, None, None] >= 0).all(2) & (candidates >= 0)
+		first = numpy.argmax(inside, 1)
+		found = inside[numpy.arange(len(xs)), first]
+		return numpy.where(found, self.ownerArray[candidates[numpy.arange(len(xs)), first]], -1)
+
+def fromRecords(triangles, offsets, cellSize = 1.0):
+	# RegionIndex over flat (x1, y1, x2, y2, x3, y3) triangle records, with
+	# region i made of triangles offsets[i] to offsets[i + 1] - 1, e.g. the
+	# typed views of a compiled map, without a region or triangle object
+	# per record
+	index = RegionIndex((), cellSize)
+	corners = []
+	for regionIndex in range(max(0, len(offsets) - 1)):
+		for k in range(offsets[regionIndex], offsets[regionIndex + 1]):
+			t = triangles[k * 6:(k + 1) * 6]
+			corners.append((regionIndex, ((t[0], t[1]), (t[2], t[3]), (t[4], t[5]))))
+	index.build(corners, cellSize)
+	return index
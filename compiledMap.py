@@ -0,0 +1,322 @@
+# Compiled binary maps
+# Turns the text map format into fixed layout arrays that are loaded
+# through mmap, e.g.
+#   python compiledMap.py test.map test.rcm
+
+import sys
+import mmap
+import struct
+import argparse
+from array import array
+import wallGrid
+import wallStore
+import collisionIndex
+import visibility
+
+MAGIC = b"RCMAP\0"
+VERSION = 1
+# Stored as written, so a file from a host of the other byte order is
+# recognised rather than misread
+BYTE_ORDER = 0x01020304
+HEADER = struct.Struct("=6sHII")
+ENTRY = struct.Struct("=4sQQ")
+
+SECTIONS = ["Textures:", "Sprites:", "Lines:", "Static:", "Item:", "Collision:", "Animated:", "FrameSet:", "Dynamic:"]
+
+# Sprite records are (kind, index, x, y, z, extra, r, offX, offY) with
+# extra the frame set of an animated sprite or the type of an item
+STATIC = 0
+ANIMATED = 1
+ITEM = 2
+SPRITE_FIELDS = 9
+WALL_FIELDS = 6
+# Dynamic wall records are a wall record then (travelX, travelY, speed,
+# wait, frameSet), with these defaults when left out
+DYNAMIC_FIELDS = 11
+DYNAMIC_DEFAULTS = [0, 0, 0, 0, -1]
+TRIANGLE_FIELDS = 6
+# Defaults for the optional sprite parameters, (extra, r, offX, offY)
+SPRITE_DEFAULTS = {STATIC: [-1, 0.1, 0.5, 0.5], ANIMATED: [-1, 0.1, 0.5, 0.5], ITEM: [0, 0.1, 0.5, 1.0]}
+
+class MapSource:
+	# Raw records of a text map, read in one pass
+	def __init__(self, fileName):
+		self.textures = []
+		self.images = []
+		self.frameSets = []
+		self.walls = []
+		self.dynamicWalls = []
+		self.sprites = []
+		self.regions = []
+		kinds = {"Static:": STATIC, "Animated:": ANIMATED, "Item:": ITEM}
+
+		mapFile = open(fileName, "r")
+		section = None
+		for text in mapFile:
+			text = text.strip()
+			if text == "":
+				continue
+			if text in SECTIONS:
+				section = text
+				continue
+			if section == "Textures:":
+				self.textures.append(text)
+			elif section == "Sprites:":
+				self.images.append(text)
+			elif section == "FrameSet:":
+				self.frameSets.append([int(value) for value in text.split()])
+			elif section == "Collision:":
+				# Each R line starts a region of triangles
+				if text[0] == "R":
+					self.regions.append([])
+				elif self.regions:
+					self.regions[-1].append([float(value) for value in text.split()][:TRIANGLE_FIELDS])
+			elif section == "Lines:":
+				self.walls.append([float(value) for value in text.split()][:WALL_FIELDS])
+			elif section == "Dynamic:":
+				params = [float(value) for value in text.split()]
+				self.dynamicWalls.append((params + DYNAMIC_DEFAULTS[len(params) - WALL_FIELDS:])[:DYNAMIC_FIELDS])
+			elif section in kinds:
+				kind = kinds[section]
+				params = [float(value) for value in text.split()]
+				optional = params[4:]
+				if kind == STATIC:
+					# Static lines go straight on to r offX offY
+					optional = [-1] + optional
+				self.sprites.append([kind] + params[:4] + (optional + SPRITE_DEFAULTS[kind][len(optional):])[:4])
+		mapFile.close()
+
+def packStrings(strings):
+	return "\n".join(strings).encode("utf-8")
+
+def packOffsets(groups):
+	# Start of each group in the flattened data, plus the end
+	offsets = array("i", [0])
+	for group in groups:
+		offsets.append(offsets[-1] + len(group))
+	return offsets
+
+def compileMap(sourceName, targetName, cellSize = 1.0, pvsSpacing = 0):
+	# pvsSpacing is the distance between the points visibility is sampled
+	# from, 0 to leave the potentially visible sets out. The pass grows
+	# with sample points times walls and sprites, so it is only run when
+	# asked for.
+	source = MapSource(sourceName)
+	sections = []
+	sections.append((b"TEXP", packStrings(source.textures)))
+	sections.append((b"SPRP", packStrings(source.images)))
+	sections.append((b"FSOF", packOffsets(source.frameSets).tobytes()))
+	sections.append((b"FSET", array("i", [frame for frameSet in source.frameSets for frame in frameSet]).tobytes()))
+	wallRecords = array("d", [value for wall in source.walls for value in wall])
+	sections.append((b"WALL", wallRecords.tobytes()))
+	sections.append((b"DYNW", array("d", [value for wall in source.dynamicWalls for value in wall]).tobytes()))
+	sections.append((b"SPRT", array("d", [value for sprite in source.sprites for value in sprite]).tobytes()))
+	sections.append((b"RGOF", packOffsets(source.regions).tobytes()))
+	sections.append((b"TRIS", array("d", [value for region in source.regions for triangle in region for value in triangle]).tobytes()))
+
+	# Wall grid cells as offsets into a flat list of wall indices. Only
+	# static walls are placed, and only they block sight in the visible
+	# sets; dynamic walls are added when the map is loaded.
+	grid = wallGrid.WallGrid(wallStore.fromRecords(wallRecords, WALL_FIELDS), cellSize)
+	sections.append((b"GRDH", array("d", [grid.cellSize, grid.minX, grid.minY, grid.width, grid.height]).tobytes()))
+	sections.append((b"GROF", packOffsets(grid.cells).tobytes()))
+	sections.append((b"GRID", array("i", [wall for cell in grid.cells for wall in cell]).tobytes()))
+
+	# Walls and sprites visible from each collision region
+	if pvsSpacing > 0 and source.regions:
+		sets = visibility.computeSets(grid, source.regions, [(sprite[2], sprite[3]) for sprite in source.sprites], pvsSpacing)
+		sections.append((b"PVOF", packOffsets([wallSet for wallSet, spriteSet in sets]).tobytes()))
+		sections.append((b"PVSW", array("i", [wall for wallSet, spriteSet in sets for wall in wallSet]).tobytes()))
+		sections.append((b"PSOF", packOffsets([spriteSet for wallSet, spriteSet in sets]).tobytes()))
+		sections.append((b"PVSS", array("i", [sprite for wallSet, spriteSet in sets for sprite in spriteSet]).tobytes()))
+
+	# Section data starts after the table, each aligned to 8 bytes
+	offset = HEADER.size + ENTRY.size * len(sections)
+	table = []
+	for tag, data in sections:
+		offset += -offset % 8
+		table.append((tag, offset, len(data)))
+		offset += len(data)
+
+	mapFile = open(targetName, "wb")
+	mapFile.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER, len(sections)))
+	for entry in table:
+		mapFile.write(ENTRY.pack(*entry))
+	for entry, section in zip(table, sections):
+		mapFile.write(b"\0" * (entry[1] - mapFile.tell()))
+		mapFile.write(section[1])
+	mapFile.close()
+
+def isCompiled(fileName):
+	mapFile = open(fileName, "rb")
+	magic = mapFile.read(len(MAGIC))
+	mapFile.close()
+	return magic == MAGIC
+
+class CompiledMap:
+	# A compiled map mapped into memory. The record sections are typed
+	# views straight into the file; nothing is copied or parsed until asked.
+	def __init__(self, fileName):
+		mapFile = open(fileName, "rb")
+		self.data = mmap.mmap(mapFile.fileno(), 0, access = mmap.ACCESS_READ)
+		mapFile.close()
+		magic, version, byteOrder, count = HEADER.unpack_from(self.data, 0)
+		if magic != MAGIC:
+			raise ValueError("%s is not a compiled map" % (fileName,))
+		if version != VERSION or byteOrder != BYTE_ORDER:
+			raise ValueError("%s was compiled for another version or byte order, recompile it" % (fileName,))
+		self.sections = {}
+		for i in range(count):
+			tag, start, size = ENTRY.unpack_from(self.data, HEADER.size + ENTRY.size * i)
+			self.sections[tag] = (start, size)
+
+		self.view = memoryview(self.data)
+		self.walls = self.section(b"WALL", "d")
+		self.dynamicWalls = self.section(b"DYNW", "d")
+		self.sprites = self.section(b"SPRT", "d")
+		self.triangles = self.section(b"TRIS", "d")
+		self.regionOffsets = self.section(b"RGOF", "i")
+		self.frameOffsets = self.section(b"FSOF", "i")
+		self.frames = self.section(b"FSET", "i")
+		self.visibleOffsets = self.section(b"PVOF", "i")
+		self.visibleWallIndices = self.section(b"PVSW", "i")
+		self.visibleSpriteOffsets = self.section(b"PSOF", "i")
+		self.visibleSpriteIndices = self.section(b"PVSS", "i")
+		self.wallCount = len(self.walls) // WALL_FIELDS
+		self.dynamicCount = len(self.dynamicWalls) // DYNAMIC_FIELDS
+		self.spriteCount = len(self.sprites) // SPRITE_FIELDS
+		self.regionCount = max(0, len(self.regionOffsets) - 1)
+		self.frameSetCount = max(0, len(self.frameOffsets) - 1)
+		# Regions with a potentially visible set, 0 if none were compiled
+		self.visibleCount = max(0, len(self.visibleOffsets) - 1)
+
+	def section(self, tag, format):
+		# Typed view of a section, empty if the map has none
+		if tag not in self.sections:
+			return memoryview(array(format))
+		start, size = self.sections[tag]
+		return self.view[start:start + size].cast(format)
+
+	def strings(self, tag):
+		start, size = self.sections.get(tag, (0, 0))
+		if size == 0:
+			return []
+		return bytes(self.view[start:start + size]).decode("utf-8").split("\n")
+
+	def texturePaths(self):
+		return self.strings(b"TEXP")
+
+	def imagePaths(self):
+		return self.strings(b"SPRP")
+
+	def frameSet(self, i):
+		return self.frames[self.frameOffsets[i]:self.frameOffsets[i + 1]].tolist()
+
+	def wall(self, i):
+		# (x1, y1, x2, y2, texture, textureTile)
+		return self.walls[i * WALL_FIELDS:(i + 1) * WALL_FIELDS].tolist()
+
+	def dynamicWall(self, i):
+		# (x1, y1, x2, y2, texture, textureTile, travelX, travelY, speed, wait, frameSet)
+		return self.dynamicWalls[i * DYNAMIC_FIELDS:(i + 1) * DYNAMIC_FIELDS].tolist()
+
+	def sprite(self, i):
+		# (kind, index, x, y, z, extra, r, offX, offY)
+		return self.sprites[i * SPRITE_FIELDS:(i + 1) * SPRITE_FIELDS].tolist()
+
+	def region(self, i):
+		# Triangles of region i as lists of (x1, y1, x2, y2, x3, y3)
+		first = self.regionOffsets[i]
+		last = self.regionOffsets[i + 1]
+		return [self.triangles[k * TRIANGLE_FIELDS:(k + 1) * TRIANGLE_FIELDS].tolist() for k in range(first, last)]
+
+	def visibleWalls(self, i):
+		# Indices of the walls that can be seen from region i
+		return self.visibleWallIndices[self.visibleOffsets[i]:self.visibleOffsets[i + 1]].tolist()
+
+	def visibleSprites(self, i):
+		# Indices, in map order, of the sprites that can be seen from region i
+		return self.visibleSpriteIndices[self.visibleSpriteOffsets[i]:self.visibleSpriteOffsets[i + 1]].tolist()
+
+	def staticWalls(self):
+		# WallStore of the static walls, read straight from the records
+		return wallStore.fromRecords(self.walls, WALL_FIELDS)
+
+	def regionIndex(self, cellSize = 1.0):
+		# RegionIndex of the collision regions, read straight from the
+		# records
+		return collisionIndex.fromRecords(self.triangles, self.regionOffsets, cellSize)
+
+	def wallGrid(self, walls):
+		# The compiled WallGrid over walls, which must start with this map's
+		# static walls in order, or None if the map has no grid
+		if b"GRDH" not in self.sections:
+			return None
+		cellSize, minX, minY, width, height = self.section(b"GRDH", "d").tolist()
+		return wallGrid.fromCells(walls, cellSize, minX, minY, int(width), int(height), self.section(b"GROF", "i").tolist(), self.section(b"GRID", "i").tolist())
+
+def checkMap(sourceName, targetName):
+	# Compare the compiled records of targetName with what the game's text
+	# loader reads from sourceName. Returns a list of differences.
+	import raycasting10
+	sprImages = []
+	textures = []
+	frameSets = []
+	lines = []
+	regions = []
+	sprites = []
+	dynamicLines = []
+	raycasting10.loadMap(sourceName, sprImages, textures, lines, regions, sprites, frameSets, dynamicLines)
+	compiled = CompiledMap(targetName)
+	problems = []
+	if (compiled.wallCount, compiled.dynamicCount, compiled.spriteCount, compiled.regionCount) != (len(lines), len(dynamicLines), len(sprites), len(regions)):
+		problems.append("record counts differ")
+	for i, line in enumerate(lines[:compiled.wallCount]):
+		if compiled.wall(i) != [line.x1, line.y1, line.x2, line.y2, line.texture, line.tTexture]:
+			problems.append("wall %d differs" % (i,))
+	for i, line in enumerate(dynamicLines[:compiled.dynamicCount]):
+		record = compiled.dynamicWall(i)
+		frames = [record[4]]
+		if record[10] >= 0:
+			frames = compiled.frameSet(int(record[10]))
+		if record[:10] != [line.x1, line.y1, line.x2, line.y2, line.texture, line.tTexture, line.travelX, line.travelY, line.speed, line.wait] or frames != line.frames:
+			problems.append("dynamic wall %d differs" % (i,))
+	for i, sprite in enumerate(sprites[:compiled.spriteCount]):
+		kind, index, x, y, z, extra, r, offX, offY = compiled.sprite(i)
+		if [index, x, y, z, r, offX, offY] != [sprite.index, sprite.x, sprite.y, sprite.z, sprite.r, sprite.offX, sprite.offY]:
+			problems.append("sprite %d differs" % (i,))
+		elif kind == ITEM and extra != sprite.type:
+			problems.append("item %d type differs" % (i,))
+		elif kind == ANIMATED and extra >= 0 and compiled.frameSet(int(extra)) != sprite.frames:
+			problems.append("animated sprite %d frames differ" % (i,))
+	for i, region in enumerate(regions[:compiled.regionCount]):
+		if compiled.region(i) != [[value for point in triangle.points for value in point] for triangle in region.triangles]:
+			problems.append("region %d differs" % (i,))
+	return problems
+
+def parseOptions(args = None):
+	parser = argparse.ArgumentParser(description = "Compile a text map into the binary map format")
+	parser.add_argument("source", help = "text map to compile")
+	parser.add_argument("target", nargs = "?", help = "compiled map to write, the source name with .rcm by default")
+	parser.add_argument("--cell-size", dest = "cellSize", type = float, default = 1.0, help = "wall grid cell size")
+	parser.add_argument("--check", action = "store_true", help = "load the source with the game's text loader afterwards and compare it with the compiled records")
+	parser.add_argument("--pvs-spacing", dest = "pvsSpacing", type = float, default = 0, help = "distance between the points visibility is sampled from in each collision region, e.g. 0.5, to add potentially visible sets. 0, the default, leaves them out.")
+	return parser.parse_args(args)
+
+def main():
+	options = parseOptions()
+	target = options.target
+	if target is None:
+		target = options.source.rsplit(".", 1)[0] + ".rcm"
+	compileMap(options.source, target, options.cellSize, options.pvsSpacing)
+	sys.stdout.write("%s -> %s\n" % (options.source, target))
+	if options.check:
+		problems = checkMap(options.source, target)
+		for problem in problems:
+			sys.stdout.write("%s\n" % (problem,))
+		if problems:
+			sys.exit(1)
+		sys.stdout.write("compiled records match the text map\n")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,102 @@
+# Entity store for sprites and items
+# Keeps every entity as one row across flat column arrays and hands out
+# stable integer handles, so removing an entity is a swap with the last row
+
+from array import array
+import animation
+
+class EntityStore:
+	# Row i of every column belongs to the entity whose handle is
+	# handles[i]. Rows move when another entity is removed; handles do not.
+	def __init__(self, frameSets = None):
+		# Frame sets the animated entities play
+		if frameSets is None:
+			frameSets = animation.FrameSets()
+		self.frameSets = frameSets
+		self.x = array("d")
+		self.y = array("d")
+		self.z = array("d")
+		self.r = array("d")
+		self.offX = array("d")
+		self.offY = array("d")
+		# Position at the start of the current simulation step, for
+		# interpolating between steps when rendering
+		self.lastX = array("d")
+		self.lastY = array("d")
+		# Sprite image shown and entity type (0 solid, otherwise a pick up)
+		self.index = array("i")
+		self.type = array("i")
+		# Frame set played, -1 for still sprites, and the time it started
+		self.frameSet = array("i")
+		self.start = array("d")
+		# Written by the renderer each frame
+		self.distance = array("d")
+		self.visible = array("i")
+		self.screenX = array("d")
+		self.screenY = array("d")
+		self.handles = []
+		self.rows = {}
+		self.nextHandle = 0
+		self.columns = [self.x, self.y, self.lastX, self.lastY, self.z, self.r, self.offX, self.offY, self.index, self.type, self.frameSet, self.start, self.distance, self.visible, self.screenX, self.screenY, self.handles]
+
+	def __len__(self):
+		return len(self.handles)
+
+	def __contains__(self, handle):
+		return handle in self.rows
+
+	def add(self, index, x, y, z, r = 0.1, offX = 0.5, offY = 0.5, type = 0, frames = None, start = 0.0):
+		handle = self.nextHandle
+		self.nextHandle += 1
+		self.rows[handle] = len(self.handles)
+		self.x.append(x)
+		self.y.append(y)
+		self.lastX.append(x)
+		self.lastY.append(y)
+		self.z.append(z)
+		self.r.append(r)
+		self.offX.append(offX)
+		self.offY.append(offY)
+		self.index.append(int(index))
+		self.type.append(int(type))
+		if frames is not None and len(frames) > 1:
+			self.frameSet.append(self.frameSets.add(frames))
+		else:
+			self.frameSet.append(-1)
+		self.start.append(start)
+		self.distance.append(0.0)
+		self.visible.append(0)
+		self.screenX.append(0.0)
+		self.screenY.append(0.0)
+		self.handles.append(handle)
+		return handle
+
+	def addSprite(self, sprite):
+		# Copy a StaticSprite, AnimatedSprite or Item from the map loader
+		return self.add(sprite.index, sprite.x, sprite.y, sprite.z, sprite.r, sprite.offX, sprite.offY, sprite.type, getattr(sprite, "frames", None))
+
+	def row(self, handle):
+		return self.rows[handle]
+
+	def remove(self, handle):
+		# Move the last row into the removed one
+		row = self.rows.pop(handle)
+		last = len(self.handles) - 1
+		if row != last:
+			for column in self.columns:
+				column[row] = column[last]
+			self.rows[self.handles[row]] = row
+		for column in self.columns:
+			column.pop()
+
+	def snapshot(self):
+		# Remember every position before a simulation step moves anything
+		self.lastX[:] = self.x
+		self.lastY[:] = self.y
+
+	def showFrame(self, row, time):
+		# Set the image of an animated row to its frame at time, called only
+		# for rows about to be drawn
+		frameSet = self.frameSet[row]
+		if frameSet >= 0:
+			self.index[row] = self.frameSets.frame(frameSet, time - self.start[row])
@@ -0,0 +1,129 @@
+# Direct framebuffer wall rasterizer
+# Writes wall texels straight into a surfarray view of the target surface
+# instead of building and blitting one small Surface per column
+
+import numpy
+import pygame
+from collections import OrderedDict
+
+class RowTable:
+	# Source rows and fixed point weights for scaling a srcHeight texture
+	# column to dstHeight rows. These reproduce pygame's generic smoothscale
+	# filter, so the rasterized columns match the blit path.
+	def __init__(self, srcHeight, dstHeight):
+		self.srcHeight = srcHeight
+		self.dstHeight = dstHeight
+		# Non-zero for shrunk columns, which are rescaled after summing
+		self.recip = 0
+		if dstHeight >= srcHeight:
+			# Bilinear expansion between two neighbouring rows. An equal
+			# height is a straight copy, which is the same table with weight 1.
+			y = numpy.arange(dstHeight, dtype = numpy.int64)
+			if dstHeight == srcHeight:
+				row0 = y
+				mult1 = numpy.zeros(dstHeight, dtype = numpy.int64)
+			else:
+				row0 = y * (srcHeight - 1) // dstHeight
+				mult1 = 0x10000 * ((y * (srcHeight - 1)) % dstHeight) // dstHeight
+			self.rows = numpy.stack([row0, numpy.minimum(row0 + 1, srcHeight - 1)], 1)
+			self.weights = numpy.stack([0x10000 - mult1, mult1], 1)
+		else:
+			# Box filter accumulating whole and partial source rows
+			ySpace = 0x10000 * srcHeight // dstHeight
+			self.recip = 0x100000000 // ySpace
+			yCounter = ySpace
+			taps = [[]]
+			for y in range(srcHeight):
+				if yCounter > 0x10000:
+					taps[-1].append((y, 0x10000))
+					yCounter -= 0x10000
+				else:
+					yFrac = 0x10000 - yCounter
+					taps[-1].append((y, yCounter))
+					taps.append([(y, yFrac)])
+					yCounter = ySpace - yFrac
+			taps = taps[:dstHeight]
+			width = max(len(tap) for tap in taps)
+			self.rows = numpy.zeros((dstHeight, width), dtype = numpy.int64)
+			self.weights = numpy.zeros((dstHeight, width), dtype = numpy.int64)
+			for y, tap in enumerate(taps):
+				for k, (row, weight) in enumerate(tap):
+					self.rows[y, k] = row
+					self.weights[y, k] = weight
+
+class FrameBufferRasterizer:
+	def __init__(self, textures, budget = 8 * 1024 * 1024, quantum = 1):
+		# budget is the most bytes of scaled columns kept at once, quantum
+		# the height step columns are rounded down to
+		self.budget = budget
+		self.quantum = max(1, int(quantum))
+		self.tables = {}
+		self.scaled = OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.pending = []
+		self.columns = 0
+		self.setTextures(textures)
+
+	def setTextures(self, textures):
+		# Texels of every texture as (width, height, rgb) arrays
+		self.textures = textures
+		self.texels = [pygame.surfarray.array3d(texture).astype(numpy.int64) for texture in textures]
+		self.scaled.clear()
+		self.size = 0
+
+	def table(self, srcHeight, dstHeight):
+		key = (srcHeight, dstHeight)
+		table = self.tables.get(key)
+		if table is None:
+			table = RowTable(srcHeight, dstHeight)
+			self.tables[key] = table
+		return table
+
+	def column(self, texture, textureX, height):
+		# Texture column textureX scaled to height rows, as an (height, rgb)
+		# array. Recently used columns are kept up to the byte budget.
+		key = (texture, textureX, height)
+		column = self.scaled.pop(key, None)
+		if column is not None:
+			self.hits += 1
+			self.scaled[key] = column
+			return column
+
+		self.misses += 1
+		texels = self.texels[texture][textureX]
+		table = self.table(len(texels), height)
+		if table.recip:
+			column = ((((texels[table.rows] * table.weights[:, :, None]) >> 16).sum(1) * table.recip) >> 16).astype(numpy.uint8)
+		else:
+			column = ((texels[table.rows] * table.weights[:, :, None]).sum(1) >> 16).astype(numpy.uint8)
+		if column.nbytes <= self.budget:
+			self.scaled[key] = column
+			self.size += column.nbytes
+			while self.size > self.budget:
+				oldKey, oldColumn = self.scaled.popitem(last = False)
+				self.size -= oldColumn.nbytes
+		return column
+
+	def addColumn(self, x, width, top, height, texture, textureX):
+		# Queue a wall column for the next flush
+		height = int(height) // self.quantum * self.quantum
+		if height > 0:
+			self.pending.append((x, width, top, height, texture, textureX))
+
+	def flush(self, surface):
+		# Copy all queued columns into the surface's pixels, one slice
+		# assignment per column
+		if not self.pending:
+			return
+		surfaceHeight = surface.get_height()
+		pixels = pygame.surfarray.pixels3d(surface)
+		for x, width, top, height, texture, textureX in self.pending:
+			first = max(0, -top)
+			last = min(height, surfaceHeight - top)
+			if first < last:
+				pixels[x:x + width, top + first:top + last] = self.column(texture, textureX, height)[first:last]
+		self.columns += len(self.pending)
+		self.pending = []
+		del pixels
@@ -0,0 +1,98 @@
+# Per-stage frame profiler
+# Times each stage of a frame, keeps per-frame counters and can draw both
+# onto the HUD with the bitmap font
+
+import timeit
+
+class FrameProfiler:
+	def __init__(self, smoothing = 0.9):
+		# Seconds per stage and counts for the last finished frame
+		self.times = {}
+		self.counters = {}
+		# Settings shown as text, kept until they are changed
+		self.labels = {}
+		self.frameTime = 0.0
+		# Smoothed milliseconds per stage for the overlay
+		self.averages = {}
+		self.averageFrame = 0.0
+		self.smoothing = smoothing
+		# Stages in the order they were first reported. A stage joins at the
+		# end of its first frame, once it has an average to show.
+		self.order = []
+		self.visible = 0
+		self.frames = 0
+		self.current = {}
+		self.currentCounters = {}
+		self.frameStart = timeit.default_timer()
+		self.mark = self.frameStart
+
+	def toggle(self):
+		self.visible = not self.visible
+
+	def beginFrame(self):
+		self.current = {}
+		self.currentCounters = {}
+		self.frameStart = timeit.default_timer()
+		self.mark = self.frameStart
+
+	def lap(self, stage):
+		# Charge the time since the last lap to stage
+		now = timeit.default_timer()
+		if stage not in self.current:
+			self.current[stage] = 0.0
+		self.current[stage] += now - self.mark
+		self.mark = now
+
+	def skip(self):
+		# Leave the time since the last lap unaccounted
+		self.mark = timeit.default_timer()
+
+	def label(self, name, text):
+		self.labels[name] = text
+
+	def count(self, name, amount = 1):
+		self.currentCounters[name] = self.currentCounters.get(name, 0) + amount
+
+	def endFrame(self):
+		self.frameTime = timeit.default_timer() - self.frameStart
+		self.times = self.current
+		self.counters = self.currentCounters
+		if self.frames == 0:
+			self.averageFrame = self.frameTime * 1000
+		else:
+			self.averageFrame = self.averageFrame * self.smoothing + self.frameTime * 1000 * (1 - self.smoothing)
+		for stage in self.times:
+			if stage not in self.order:
+				self.order.append(stage)
+		for stage in self.order:
+			ms = self.times.get(stage, 0.0) * 1000
+			if stage in self.averages:
+				self.averages[stage] = self.averages[stage] * self.smoothing + ms * (1 - self.smoothing)
+			else:
+				self.averages[stage] = ms
+		self.frames += 1
+
+	def lines(self):
+		# Overlay text, one stage or counter pair per line
+		fps = 0.0
+		if self.averageFrame > 0:
+			fps = 1000 / self.averageFrame
+		text = ["frame %6.2f ms %5.1f fps" % (self.averageFrame, fps)]
+		for name in sorted(self.labels):
+			text.append("%s %s" % (name, self.labels[name]))
+		for stage in self.order:
+			text.append("%-8s %6.2f ms" % (stage, self.averages[stage]))
+		names = sorted(self.counters)
+		i = 0
+		while i < len(names):
+			pair = names[i:i + 2]
+			text.append("  ".join("%s %d" % (name, self.counters[name]) for name in pair))
+			i += 2
+		return text
+
+	def draw(self, font, target, x, y, color = (255, 255, 0)):
+		if not self.visible:
+			return
+		for line in self.lines():
+			font.bitmapPrint(target, x, y, line, color)
+			y += font.height
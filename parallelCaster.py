@@ -0,0 +1,107 @@
+# Column-parallel wall casting
+# Splits the screen's columns into strips and casts them on a pool of
+# worker processes
+
+import multiprocessing
+from array import array
+
+# The caster each worker process casts with. It is set once when the
+# worker starts, so the wall data is never sent again per frame.
+workerCaster = None
+# Rows of the moved walls as the worker's caster last had them
+workerWalls = {}
+
+class Pose:
+	# The parts of Player the casters read
+	def __init__(self, x, y, angle, fov, clip):
+		self.x = x
+		self.y = y
+		self.angle = angle
+		self.fov = fov
+		self.clip = clip
+
+class Wall:
+	# The parts of LineSeg the casters read
+	def __init__(self, x1, y1, x2, y2, texture, tTexture):
+		self.x1 = x1
+		self.y1 = y1
+		self.x2 = x2
+		self.y2 = y2
+		self.texture = texture
+		self.tTexture = tTexture
+
+def initWorker(caster):
+	global workerCaster
+	workerCaster = caster
+
+def castStrip(job):
+	# Cast columns first to last - 1 and pack the hits into flat arrays of
+	# (column, distance, texture, texVert, height)
+	pose, visible, moved, resWidth, screenWidth, first, last = job
+	workerCaster.setVisible(visible)
+	for i, row in moved.items():
+		if workerWalls.get(i) != row:
+			workerCaster.moveWall(i, Wall(*row))
+			workerWalls[i] = row
+	screenLineIndex = workerCaster.castRange(Pose(*pose), resWidth, screenWidth, first, last)
+	columns = array("i")
+	distance = array("d")
+	texture = array("i")
+	texVert = array("d")
+	height = array("d")
+	for hit in screenLineIndex:
+		distance.append(hit[0])
+		texture.append(hit[1])
+		height.append(hit[2])
+		columns.append(hit[3])
+		texVert.append(hit[4])
+	return columns, distance, texture, texVert, height, workerCaster.tested
+
+class ParallelCaster:
+	# Wraps any caster with castRange, setVisible and moveWall methods.
+	# Each worker holds its own copy of the caster: inherited when the
+	# platform forks, otherwise sent once when the pool starts.
+	def __init__(self, caster, workers, stripsPerWorker = 2):
+		self.caster = caster
+		self.workers = workers
+		# More strips than workers evens out strips that take longer
+		self.strips = workers * stripsPerWorker
+		# Walls the workers test, and the current rows of every wall that
+		# has moved, sent with every job
+		self.visible = None
+		self.moved = {}
+		# Rays cast and walls tested by the last cast
+		self.rays = 0
+		self.tested = 0
+		self.pool = multiprocessing.Pool(workers, initWorker, (caster,))
+
+	def setVisible(self, visible):
+		self.visible = visible
+
+	def moveWall(self, i, line):
+		# Workers pick the new row up with their next job
+		self.caster.moveWall(i, line)
+		self.moved[i] = (line.x1, line.y1, line.x2, line.y2, line.texture, line.tTexture)
+
+	def cast(self, player, resWidth, screenWidth):
+		pose = (player.x, player.y, player.angle, player.fov, player.clip)
+		resWidth = int(resWidth)
+		strips = min(self.strips, resWidth)
+		jobs = []
+		for strip in range(strips):
+			jobs.append((pose, self.visible, self.moved, resWidth, screenWidth, resWidth * strip // strips, resWidth * (strip + 1) // strips))
+
+		screenLineIndex = []
+		self.rays = resWidth
+		self.tested = 0
+		for columns, distance, texture, texVert, height, tested in self.pool.map(castStrip, jobs):
+			screenLineIndex.extend(zip(distance, texture, height, columns, texVert))
+			self.tested += tested
+
+		return screenLineIndex
+
+	def close(self):
+		# Workers forked after pygame.init inherit SDL's SIGTERM handler,
+		# so they are asked to finish rather than terminated
+		self.pool.close()
+		self.pool.join()
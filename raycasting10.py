@@ -4,9 +4,42 @@
 
 import pygame
 import math
+import argparse
+import timeit
 import bitmapFont
+import rays
+import bspTree
+import wallGrid
+import wallStore
+import spanBuffer
+import textureCache
+import spriteCache
+import frameProfiler
+import adaptiveResolution
+import parallelCaster
+import compiledMap
+import collisionIndex
+import spatialHash
+import entityStore
+import animation
 from collections import deque
 
+try:
+	import vectorCaster
+except ImportError:
+	vectorCaster = None
+	
+try:
+	import frameBuffer
+except ImportError:
+	frameBuffer = None
+	
+# Game steps per second. A slow frame catches up at most MAX_LAG seconds
+# of steps, so a long stall does not turn into a burst of them.
+STEP_RATE = 30
+STEP = 1.0 / STEP_RATE
+MAX_LAG = 0.25
+
 class MessageBox:
 	def __init__(self, x, y, charWidth, lines, messageLife):
 		self.x = x
@@ -32,135 +65,102 @@ class MessageBox:
 			self.messageTime = 0
 
 class LineSeg:
-	# Line segment wall
+	# Line segment wall. The renderer copies these into the
+	# wallStore.WallStore its caster reads.
 	def __init__(self, x1, y1, x2, y2, textureIndex, textureTile):
 		self.x1 = x1
 		self.y1= y1
 		self.x2 = x2
 		self.y2 = y2
-		if x1 != x2:
-			self.m = float((y1 - y2)/(x1 - x2))
-			self.vertical = 0
-		else:
-			self.m = 0
-			self.vertical = 1
-		self.b = float(y1 - self.m * x1)
 		self.texture = int(textureIndex)
 		self.tTexture = textureTile
-	
-	def intersectionSlopeInt(self, m, b):
-		x = 0
-		y = 0
-		texVert = 0.0
-		if m == self.m:
-			return (-1, 0, 0, 0)
-		
-		if self.vertical:
-			y = m * self.x1 + b
-			if self.y1 > self.y2 and y <= self.y1 and y >= self.y2:
-				x = self.x1
-			elif y >= self.y1 and y <= self.y2:
-				x = self.x1
-			else:
-				return (-1, 0, 0, 0)
-		else:
-			x = (b - self.b)/(self.m - m)
-			y = self.m * x + self.b
-			if not(self.x1 >= self.x2 and x <= self.x1 and x >= self.x2 or x >= self.x1 and x <= self.x2):
-				return (-1, 0, 0, 0)
-				
-		texVert = (1 - (math.sqrt((self.x1 - x)**2 + (self.y1 - y)**2) / math.sqrt((self.x1 - self.x2)**2 + (self.y1 - self.y2)**2))) * self.tTexture
-		while texVert > 1:
-			texVert -= 1
-		return (self.texture, x, y, texVert)
-				
-	def intersectionVertical(self, x):
-		y = 0
-		if self.vertical:
-			return (-1, 0, 0, 0)
-		else:
-			y = self.m * x + self.b
-			if not(self.x1 >= self.x2 and x <= self.x1 and x >= self.x2 or x >= self.x1 and x <= self.x2):
-				return (-1, 0, 0, 0)
-				
-		texVert = (1 - (math.sqrt((self.x1 - x)**2 + (self.y1 - y)**2) / math.sqrt((self.x1 - self.x2)**2 + (self.y1 - self.y2)**2))) * self.tTexture
-		while texVert > 1:
-			texVert -= 1
-		return (self.texture, x, y, texVert)
 		
 class DynamicLine (LineSeg):
-	def __init__(self, x1, y1, x2, y2, textureIndex, textureTile, frames = []):
-		self.x1 = x1
-		self.x2 = x2
-		self.y1 = y1
-		self.y2 = y2
-		self.textureIndex = textureIndex
-		self.textureTile = textureTile
+	# Wall that slides and cycles its texture, e.g. a door, lift or panel.
+	# update() runs once per game step; walls whose update returns true
+	# are passed to Renderer.moveWall.
+	def __init__(self, x1, y1, x2, y2, textureIndex, textureTile, frames = None, travelX = 0, travelY = 0, speed = 0, wait = 0, start = 0.0):
+		LineSeg.__init__(self, x1, y1, x2, y2, textureIndex, textureTile)
+		# Texture indices to cycle through from time start. The renderer
+		# swaps texture for an animated texture that plays them.
+		if not frames:
+			frames = [self.texture]
 		self.frames = frames
-		if self.frames == []:
-			self.frames.append(textureIndex)
 		self.frameCount = len(self.frames)
-		self.cFrame = 0
+		self.start = start
+		# Movement still to go and speed per step along each axis
 		self.vx = 0
 		self.vy = 0
 		self.dx = 0
 		self.dy = 0
+		# A wall with a speed goes back and forth between where it started
+		# and travelX, travelY away, waiting wait steps at each end
+		self.home = (x1, y1, x2, y2)
+		self.travelX = travelX
+		self.travelY = travelY
+		self.speed = speed
+		self.wait = int(wait)
+		self.waitTime = self.wait
+		self.out = 0
 		
 	def move(self, dx, dy, vx, vy):
+		# Slide by (dx, dy), at most (vx, vy) each step
 		self.dx = dx
 		self.dy = dy
-		self.vx = vx
-		self.vy = vy
+		self.vx = abs(vx)
+		self.vy = abs(vy)
 		
 	def update(self):
-		if self.frameCount > 1:
-			self.cFrame += 1
-			self.cFrame %= self.frameCount
-			self.textureIndex = self.frames[self.cFrame]
-		
-		if self.dx != 0:
-			oldDX = self.dx
-			self.x1 += self.vx
-			self.x2 += self.vx
-			self.dx += self.vx
-			if self.dx * oldDX < 0:
-				self.dx = 0
-				
-		if self.dy != 0:
-			oldDY = self.dy
-			self.y1 += self.vy
-			self.y2 += self.vy
-			self.dy += self.vy
-			if self.dy * oldDY < 0:
-				self.dy = 0
+		changed = 0
+		if self.dx == 0 and self.dy == 0 and self.speed > 0:
+			if self.waitTime > 0:
+				self.waitTime -= 1
+			else:
+				self.startLeg()
+		
+		if self.dx != 0 or self.dy != 0:
+			stepX = math.copysign(min(self.vx, abs(self.dx)), self.dx)
+			stepY = math.copysign(min(self.vy, abs(self.dy)), self.dy)
+			self.x1 += stepX
+			self.x2 += stepX
+			self.y1 += stepY
+			self.y2 += stepY
+			self.dx -= stepX
+			self.dy -= stepY
+			if self.dx == 0 and self.dy == 0 and self.speed > 0:
+				self.endLeg()
+			changed = 1
+		
+		return changed
+		
+	def startLeg(self):
+		# Head for the far end of the track, or back home
+		length = math.hypot(self.travelX, self.travelY)
+		if length == 0:
+			return
+		direction = -1 if self.out else 1
+		self.move(self.travelX * direction, self.travelY * direction, self.travelX * self.speed / length, self.travelY * self.speed / length)
+		self.out = not self.out
+		self.waitTime = self.wait
+		
+	def endLeg(self):
+		# Land exactly on the end of the track so steps never add up to drift
+		x1, y1, x2, y2 = self.home
+		if self.out:
+			x1 += self.travelX
+			x2 += self.travelX
+			y1 += self.travelY
+			y2 += self.travelY
+		self.x1 = x1
+		self.y1 = y1
+		self.x2 = x2
+		self.y2 = y2
 		
 class Triangle:
 	# Collision object
 	def __init__(self, points):
 		self.points = points
-		self.sides = []
-		i = 0
-		while i < len(points):
-			m = 0
-			b = 0
-			vert = 0
-			neg = 0
-			nextIndex = (i + 1) % 3
-			other = i - 1
-			if points[i][0] == points[nextIndex][0]:
-				vert = 1
-				b = points[i][0]
-				if points[other][0] < points[i][0]:
-					neg = 1
-			else:
-				m = float(points[i][1] - points[nextIndex][1])/float(points[i][0] - points[nextIndex][0])
-				b = float(points[i][1] - (m * points[i][0]))
-				if points[other][1] < (m * points[other][0] + b):
-					neg = 1
-					
-			i += 1
-					
-			self.sides.append((vert, neg, m, b))
+		self.sides = collisionIndex.triangleSides(points)
 		
 	def isInside(self, point):
 		inside = 1
@@ -205,8 +205,11 @@ class CollisionRegion:
 			return inside
 		
 class VisRegion:
-	def __init__(self, lines):
+	# Potentially visible set of one collision region: the indices of the
+	# walls, and of the sprites in map order, that can be seen from it
+	def __init__(self, lines, sprites = ()):
 		self.lines = lines
+		self.sprites = set(sprites)
 		
 class Player:
 	# Player and camera data
@@ -232,10 +235,10 @@ class StaticSprite:
 		self.type = 0
 		
 	def getScale(self, distance, fov):
-		return 2 * math.atan(1 / distance) / fov
+		return spriteScale(distance, fov)
 		
 class AnimatedSprite (StaticSprite):
-	def __init__(self, index, x, y, z, frames = [], r = 0.1, offX = 0.5, offY = 0.5):
+	def __init__(self, index, x, y, z, frames = None, r = 0.1, offX = 0.5, offY = 0.5):
 		self.index = int(index)
 		self.x = x
 		self.y = y
@@ -246,17 +249,11 @@ class AnimatedSprite (StaticSprite):
 		self.screenY = 0
 		self.r = r
 		self.type = 2
+		# Images played once it is in an entity store
+		if not frames:
+			frames = [self.index]
 		self.frames = frames
-		if len(self.frames) == 0:
-			self.frames.append(index)
-		self.cFrame = 0
 		self.frameCount = len(self.frames)
-			
-	def update(self):
-		if self.frameCount > 1:
-			self.cFrame += 1
-			self.cFrame %= self.frameCount
-			self.index = self.frames[self.cFrame]
 		
 class Item (StaticSprite):
 	def __init__(self, index, x, y, z, type = 0, r = 0.1, offX = 0.5, offY = 1.0):
@@ -271,12 +268,65 @@ class Item (StaticSprite):
 		self.r = r
 		self.type = int(type)
 
-def updateSpriteList(sprites):
-	worldSprites = []
-	for sprite in sprites:
-		worldSprites.append([300, 0, sprite])
+class LineCaster:
+	# Tests every wall against every column and keeps every hit
+	def __init__(self, walls):
+		self.walls = walls
+		# Indices of the walls to test, None for all of them
+		self.visible = None
+		# Column tables of the last cast
+		self.tables = None
+		# Rays cast and walls tested by the last cast
+		self.rays = 0
+		self.tested = 0
 		
-	return worldSprites
+	def setVisible(self, visible):
+		self.visible = visible
+		
+	def moveWall(self, i, line):
+		# Refresh wall i after it moved or changed texture
+		self.walls.set(i, line)
+		
+	def cast(self, player, resWidth, screenWidth):
+		return self.castRange(player, resWidth, screenWidth, 0, resWidth)
+		
+	def castRange(self, player, resWidth, screenWidth, first, last):
+		# Columns first to last - 1 only
+		walls = self.walls
+		wallRange = self.visible
+		if wallRange is None:
+			wallRange = range(len(walls))
+		self.rays = int(last - first)
+		self.tested = self.rays * len(wallRange)
+		screenLineIndex = []
+		tables = self.tables = rays.columnTables(self.tables, player, resWidth, screenWidth)
+		xs, ys = tables.directions(player, first, last)
+		for divCount, dirX, dirY in zip(range(first, last), xs, ys):
+			ray = rays.Ray(player.x, player.y, dirX, dirY, player.clip)
+			for i in wallRange:
+				hit = walls.hit(i, ray)
+				if hit is not None:
+					# Calculate height of the vertical
+					rectHeight = tables.height(divCount, hit[0])
+			
+					# Store vertical in list
+					screenLineIndex.append((hit[0], hit[1], rectHeight, divCount, hit[2]))
+		
+		return screenLineIndex
+		
+def cameraBetween(lastX, lastY, lastAngle, player, alpha):
+	# Player as seen alpha of the way from the last step's pose to its
+	# current one, turning the short way round
+	turn = player.angle - lastAngle
+	if turn > math.pi:
+		turn -= 2 * math.pi
+	elif turn < -math.pi:
+		turn += 2 * math.pi
+	return Player(lastX + (player.x - lastX) * alpha, lastY + (player.y - lastY) * alpha, (lastAngle + turn * alpha) % (2 * math.pi), player.fov, player.clip)
+	
+def spriteScale(distance, fov):
+	# Zoom for a sprite image at distance
+	return 2 * math.atan(1 / distance) / fov
 	
 def qSort(list):
 	qSortR(list, 0, len(list) - 1)
@@ -288,12 +338,12 @@ def qSortR(list, first, last):
 		qSortR(list, pivot + 1, last)
 		
 def qSortPart(list, first, last):
-	s = (first + last)/2
+	s = (first + last) // 2
 	if list[first][0] < list[s][0]:
 		list[first], list[s] = list[s], list[first]
 	if list[first][0] < list[last][0]:
 		list[first], list[last] = list[last], list[first]
-	if list[s] < list[last]:
+	if list[s][0] < list[last][0]:
 		list[s], list[last], list[last], list[s]
 		
 	list[s], list[first] = list[first], list[s]
@@ -409,6 +459,33 @@ def loadWalls(sections, lines, mapFile):
 			
 	return nextSection
 	
+def loadDynamicWalls(sections, dynamicLines, frameSets, mapFile):
+	# x1 y1 x2 y2 texture tile, then optionally travelX travelY speed wait
+	# and a frame set of texture indices, -1 for none
+	isNewSection = 0
+	nextSection = ""
+	while not isNewSection:
+		paraString = mapFile.readline()
+		if paraString != "" and paraString != "\n":
+			paraString = paraString[:-1]
+		elif paraString == "":
+			isNewSection = 1
+			nextSection = "eof"
+		
+		for header in sections:
+			if paraString == header:
+				isNewSection = 1
+				nextSection = header
+		
+		if paraString != "\n" and not isNewSection:
+			params = [float(param) for param in paraString.split()]
+			frames = None
+			if len(params) > 10 and params[10] >= 0:
+				frames = frameSets[int(params[10])]
+			dynamicLines.append(DynamicLine(params[0], params[1], params[2], params[3], params[4], params[5], frames, *params[6:10]))
+			
+	return nextSection
+	
 def loadRegions(sections, regions, mapFile):
 	isNewSection = 0
 	nextSection = ""
@@ -430,6 +507,7 @@ def loadRegions(sections, regions, mapFile):
 				for header in sections:
 					if paraString == header:
 						isNewSection = 1
+						newRegion = 1
 						nextSection = header
 				
 				params = paraString.split()
@@ -551,8 +629,37 @@ def loadItems(sections, sprites, mapFile):
 					
 	return nextSection		
 	
-def loadMap(fileName, sprImages, textures, lines, regions, sprites, frameSets):
-	sections = ["Textures:", "Sprites:", "Lines:", "Static:", "Item:", "Collision:", "Animated:", "FrameSet:"]
+def loadCompiledMap(compiled, sprImages, textures, frameSets, dynamicLines = None):
+	# Static walls, collision regions and sprites stay in the compiled
+	# records; makeCaster, loadCollision and loadEntities read them from
+	# there
+	for path in compiled.texturePaths():
+		textures.append(pygame.image.load(path))
+	for path in compiled.imagePaths():
+		sprImages.append(pygame.image.load(path))
+	for i in range(compiled.frameSetCount):
+		frameSets.append(compiled.frameSet(i))
+	if dynamicLines is not None:
+		for i in range(compiled.dynamicCount):
+			x1, y1, x2, y2, texture, tile, travelX, travelY, speed, wait, frameSet = compiled.dynamicWall(i)
+			frames = None
+			if frameSet >= 0:
+				frames = frameSets[int(frameSet)]
+			dynamicLines.append(DynamicLine(x1, y1, x2, y2, texture, tile, frames, travelX, travelY, speed, wait))
+	
+def loadMap(fileName, sprImages, textures, lines, regions, sprites, frameSets, dynamicLines = None):
+	# Returns the CompiledMap when fileName was built by compiledMap.py,
+	# otherwise None. Dynamic walls are only loaded when a dynamicLines
+	# list is given. A compiled map leaves lines, regions and sprites
+	# empty, they are read from its records when needed.
+	if compiledMap.isCompiled(fileName):
+		compiled = compiledMap.CompiledMap(fileName)
+		loadCompiledMap(compiled, sprImages, textures, frameSets, dynamicLines)
+		return compiled
+		
+	if dynamicLines is None:
+		dynamicLines = []
+	sections = ["Textures:", "Sprites:", "Lines:", "Static:", "Item:", "Collision:", "Animated:", "FrameSet:", "Dynamic:"]
 	mapFile = open(fileName, "r")
 	currentSection = mapFile.readline()
 	currentSection = currentSection[:-1]
@@ -573,18 +680,554 @@ def loadMap(fileName, sprImages, textures, lines, regions, sprites, frameSets):
 			currentSection = loadAnimatedObjects(sections, sprites, frameSets, mapFile)
 		elif currentSection == sections[7]:
 			currentSection = loadFrameSets(sections, frameSets, mapFile)
+		elif currentSection == sections[8]:
+			currentSection = loadDynamicWalls(sections, dynamicLines, frameSets, mapFile)
 	
 		
-def main():
+def loadVisRegions(compiled):
+	# Potentially visible sets of a compiled map, one per collision region,
+	# or none for text maps and maps compiled without them. Dynamic walls,
+	# which follow the static ones, are in every set since they move.
+	if compiled is None:
+		return []
+	dynamic = list(range(compiled.wallCount, compiled.wallCount + compiled.dynamicCount))
+	return [VisRegion(compiled.visibleWalls(i) + dynamic, compiled.visibleSprites(i)) for i in range(compiled.visibleCount)]
+	
+def loadCollision(regions, compiled = None):
+	# Triangles of every collision region, bucketed for point queries,
+	# from a compiled map's records or the regions of a text map
+	if compiled is not None:
+		return compiled.regionIndex()
+	return collisionIndex.RegionIndex(regions)
+	
+def loadEntities(entities, sprites, compiled = None):
+	# Add the map's sprites to the entity store in map order, from a
+	# compiled map's records or the sprites of a text map. Returns their
+	# handles.
+	if compiled is None:
+		return [entities.addSprite(sprite) for sprite in sprites]
+	handles = []
+	for i in range(compiled.spriteCount):
+		kind, index, x, y, z, extra, r, offX, offY = compiled.sprite(i)
+		if kind == compiledMap.STATIC:
+			handles.append(entities.add(index, x, y, z, r, offX, offY))
+		elif kind == compiledMap.ITEM:
+			handles.append(entities.add(index, x, y, z, r, offX, offY, extra))
+		else:
+			# Animated, staying on its image if it has no frame set
+			frames = None
+			if extra >= 0:
+				frames = compiled.frameSet(int(extra))
+			handles.append(entities.add(index, x, y, z, r, offX, offY, 2, frames))
+	return handles
+		
+def makeCaster(engine, walls, compiled = None):
+	# Build the wall intersection engine selected at startup over a
+	# WallStore. A compiled map supplies the structures it has precomputed
+	# for its static walls; any walls past those are added to them.
+	if engine == "line":
+		return LineCaster(walls)
+	elif engine == "numpy":
+		if vectorCaster is None:
+			raise SystemExit("The numpy engine needs NumPy installed")
+		return vectorCaster.VectorCaster(walls)
+	elif engine == "bsp":
+		return bspTree.BSPCaster(walls)
+	elif engine == "grid":
+		grid = None
+		if compiled is not None:
+			grid = compiled.wallGrid(walls)
+		if grid is not None:
+			for i in range(compiled.wallCount, len(walls)):
+				grid.insert(i)
+		return wallGrid.GridCaster(walls, grid = grid)
+	else:
+		raise ValueError("Unknown engine %s" % (engine,))
+		
+def addEngineOptions(parser):
+	# Renderer options, shared with the benchmark
+	parser.add_argument("--engine", choices = ["line", "numpy", "bsp", "grid"], default = "line", help = "wall intersection engine")
+	parser.add_argument("--compose", choices = ["blit", "framebuffer"], default = "blit", help = "how wall columns are drawn")
+	parser.add_argument("--occlusion", choices = ["painter", "depth"], default = "painter", help = "draw sprites merged back to front with the walls, or clipped against each column's wall depth")
+	parser.add_argument("--workers", type = int, default = 0, help = "worker processes casting strips of columns, 0 or 1 to cast on the main thread")
+	parser.add_argument("--column-budget", dest = "columnBudget", type = int, default = 8 * 1024 * 1024, help = "bytes of scaled texture columns to keep cached")
+	parser.add_argument("--sprite-budget", dest = "spriteBudget", type = int, default = 4 * 1024 * 1024, help = "bytes of scaled sprites to keep cached")
+	parser.add_argument("--target-fps", dest = "targetFps", type = float, default = 0, help = "lower the render resolution as needed to hold this frame rate, 0 to keep it fixed")
+	
+def parseOptions(args = None):
+	parser = argparse.ArgumentParser(description = "Ray Casting")
+	parser.add_argument("--map", default = "test.map", help = "text or compiled map to load")
+	parser.add_argument("--width", type = int, default = 320, help = "window width in pixels")
+	parser.add_argument("--height", type = int, default = 240, help = "window height in pixels")
+	parser.add_argument("--render-width", dest = "renderWidth", type = int, default = 0, help = "internal render width, the window width if 0")
+	parser.add_argument("--render-height", dest = "renderHeight", type = int, default = 0, help = "internal render height, the window height if 0")
+	parser.add_argument("--rect-width", dest = "rectWidth", type = int, default = 1, help = "pixels per ray column")
+	parser.add_argument("--fps", type = int, default = 30, help = "most frames drawn per second, 0 for uncapped. The game itself always runs at %d steps per second." % (STEP_RATE,))
+	addEngineOptions(parser)
+	return parser.parse_args(args)
+	
+class Renderer:
+	# Draws the 3-D view: background, walls and sprites
+	def __init__(self, screenWidth, resHeight, rectWidth, textures, sprImages, lines, background, options, profiler = None, compiled = None):
+		# Internal render resolution at full quality. Frames are upscaled
+		# to the screen when the two differ.
+		self.baseWidth = screenWidth
+		self.baseHeight = resHeight
+		self.baseRectWidth = rectWidth
+		self.textures = textures
+		self.sprImages = sprImages
+		# Widest sprite image, so an entity can be found off screen before
+		# its animation frame is known
+		self.widestSprite = max([image.get_width() for image in sprImages] + [0])
+		self.sourceBackground = background
+		
+		# Texture numbers from len(textures) up are animated textures, each
+		# a frame set of real textures and the time it started. Walls that
+		# cycle textures are given one before the casters copy them.
+		self.frameSets = animation.FrameSets()
+		self.animatedTextures = []
+		for line in lines:
+			if isinstance(line, DynamicLine) and line.frameCount > 1:
+				line.texture = self.animatedTexture(line.frames, line.start)
+		
+		# A compiled map's static walls come first, straight from its
+		# records, then the walls in lines
+		if compiled is not None:
+			walls = compiled.staticWalls()
+		else:
+			walls = wallStore.WallStore(())
+		for line in lines:
+			walls.append(line)
+		self.caster = makeCaster(options.engine, walls, compiled)
+		if options.workers > 1:
+			self.caster = parallelCaster.ParallelCaster(self.caster, options.workers)
+		
+		# Pre-sliced wall texture columns and recently scaled copies
+		self.columnCache = textureCache.TextureColumnCache(textures, options.columnBudget)
+		
+		# Sprite mip pyramids and recently scaled sprites
+		self.spriteCache = spriteCache.SpriteCache(sprImages, options.spriteBudget)
+		
+		# Walls either go straight into the screen's pixels or are blitted
+		# column by column onto render
+		self.rasterizer = None
+		if options.compose == "framebuffer":
+			if frameBuffer is None:
+				raise SystemExit("The framebuffer compose mode needs NumPy installed")
+			self.rasterizer = frameBuffer.FrameBufferRasterizer(textures, options.columnBudget)
+		
+		self.depthSprites = options.occlusion == "depth"
+		
+		# Stage timings and counters, shared with the game loop
+		if profiler is None:
+			profiler = frameProfiler.FrameProfiler()
+		self.profiler = profiler
+		
+		# Collision regions and their potentially visible sets, if the map
+		# has them
+		self.collision = None
+		self.visRegions = []
+		
+		# Bumped whenever wall geometry changes
+		self.wallVersion = 0
+		
+		# Lowers the resolution to hold a frame rate, if one was asked for
+		self.governor = None
+		if options.targetFps > 0:
+			self.governor = adaptiveResolution.ResolutionGovernor(options.targetFps)
+		self.setResolution(screenWidth, resHeight, rectWidth)
+		
+	def setResolution(self, screenWidth, resHeight, rectWidth):
+		self.screenWidth = screenWidth
+		self.resHeight = resHeight
+		# Width of each vertical division
+		self.rectWidth = rectWidth
+		# Number of divisions
+		self.resWidth = screenWidth // rectWidth
+		
+		# Where the scene is rendered
+		self.render = pygame.Surface((screenWidth, resHeight))
+		self.render.set_colorkey((0, 0, 0))
+		# Internal frame, made when the screen is another size
+		self.frame = None
+		# Sky and floor stretched to the frame
+		self.background = self.sourceBackground
+		if self.background.get_size() != (screenWidth, resHeight):
+			self.background = pygame.transform.smoothscale(self.background, (screenWidth, resHeight))
+		
+		# Screen columns already closed by a nearer wall. Its per column
+		# depths also clip sprites in the depth occlusion mode.
+		self.spans = spanBuffer.SpanBuffer(self.resWidth)
+		
+		# What the last frame was drawn from: the camera and wall version
+		# its walls were cast for, the sprites and animated texture frames
+		# it showed and a copy of the finished scene. reused is set when a
+		# frame only copied the scene.
+		self.wallKey = None
+		self.screenLineIndex = []
+		self.hitAnimations = set()
+		self.visibleSprites = None
+		self.sceneState = None
+		self.scene = None
+		self.reused = 0
+		self.profiler.label("view", "%dx%d scale %.2f rect %d" % (screenWidth, resHeight, float(screenWidth) / self.baseWidth, rectWidth))
+		
+	def setVisibility(self, collision, visRegions):
+		# Cast and project only what can be seen from the camera's collision
+		# region. Sprite indices in the sets are map order, which is their
+		# handle when the entity store was filled in map order.
+		self.collision = collision
+		self.visRegions = visRegions
+		self.wallKey = None
+		
+	def adapt(self, frameTime):
+		# Feed the governor the last frame time and switch resolution when
+		# it picks another level. Frames that only copied the last scene say
+		# nothing about what the resolution costs.
+		if self.governor is None or self.reused:
+			return
+		level = self.governor.update(frameTime)
+		if level is not None:
+			scale, rectWidth = level
+			self.setResolution(max(1, int(self.baseWidth * scale)), max(1, int(self.baseHeight * scale)), self.baseRectWidth * rectWidth)
+		
+	def close(self):
+		# Stop the caster's worker processes, if it has any
+		if isinstance(self.caster, parallelCaster.ParallelCaster):
+			self.caster.close()
+		
+	def renderFrame(self, screen, player, entities, alpha = 1.0, time = 0.0):
+		# alpha is how far rendering is between the last simulation step
+		# and the current one, used to place moving entities. time is the
+		# game time in seconds animations are shown at. Walls are only
+		# cast again when the camera or the walls changed, and the scene is
+		# only composed again when they or the drawn sprites changed;
+		# otherwise the last scene is copied back.
+		profiler = self.profiler
+		# Draw at the internal resolution
+		view = screen
+		size = (self.screenWidth, self.resHeight)
+		if screen.get_size() != size:
+			if self.frame is None:
+				self.frame = pygame.Surface(size, 0, screen)
+			view = self.frame
+		
+		self.spans.clearSprites()
+		wallKey = (player.x, player.y, player.angle, player.fov, player.clip, self.wallVersion)
+		if wallKey != self.wallKey:
+			self.wallKey = wallKey
+			self.sceneState = None
+			
+			self.selectVisible(player)
+			screenLineIndex = self.caster.cast(player, self.resWidth, self.screenWidth)
+			profiler.count("rays", self.caster.rays)
+			profiler.count("tested", self.caster.tested)
+			profiler.count("hits", len(screenLineIndex))
+			profiler.lap("cast")
+			
+			# Drop wall columns hidden behind a nearer wall
+			self.spans.clear()
+			screenLineIndex = self.spans.cull(screenLineIndex)
+			profiler.count("culled", self.spans.wallsCulled)
+			profiler.lap("cull")
+			
+			if not self.depthSprites:
+				qSort(screenLineIndex)
+			self.screenLineIndex = screenLineIndex
+			# Animated textures that were hit
+			textureCount = len(self.textures)
+			self.hitAnimations = set(hit[1] for hit in screenLineIndex if hit[1] >= textureCount)
+			profiler.lap("sort")
+		else:
+			# Same hits, and the span buffer still holds their depths
+			screenLineIndex = self.screenLineIndex
+			profiler.count("reused walls")
+		
+		self.projectSprites(player, entities, alpha, self.visibleSprites, time)
+		profiler.lap("sprites")
+		
+		# Current frame of each animated texture on screen
+		wallFrames = {}
+		for texture in self.hitAnimations:
+			wallFrames[texture] = self.textureFrame(texture, time)
+		
+		sceneState = (self.drawnSprites(entities, player.fov), wallFrames)
+		self.reused = sceneState == self.sceneState and self.scene is not None and self.scene.get_size() == screen.get_size()
+		if self.reused:
+			screen.blit(self.scene, (0, 0))
+			profiler.count("reused scene")
+			profiler.lap("compose")
+			return screenLineIndex
+		self.sceneState = sceneState
+		
+		view.blit(self.background, (0, 0))
+		if self.rasterizer is None:
+			self.render.fill((0, 0, 0))
+		
+		if wallFrames:
+			screenLineIndex = [(hit[0], wallFrames.get(hit[1], hit[1]), hit[2], hit[3], hit[4]) for hit in screenLineIndex]
+		
+		# Entity rows from farthest to nearest
+		order = sorted(range(len(entities)), key = entities.distance.__getitem__, reverse = True)
+		profiler.lap("sort")
+		
+		if self.depthSprites:
+			self.composeDepth(view, player, entities, order, screenLineIndex)
+		else:
+			self.compose(view, player, entities, order, screenLineIndex)
+		profiler.lap("compose")
+		
+		if view is not screen:
+			pygame.transform.scale(view, screen.get_size(), screen)
+			profiler.lap("upscale")
+		
+		# Keep the scene without the HUD for the frames that can reuse it
+		if self.scene is None or self.scene.get_size() != screen.get_size():
+			self.scene = pygame.Surface(screen.get_size(), 0, screen)
+		self.scene.blit(screen, (0, 0))
+		return screenLineIndex
+		
+	def selectVisible(self, player):
+		# Only the walls and sprites of the camera's region are considered
+		self.visibleSprites = self.selectWalls(player)
+		
+	def selectWalls(self, player):
+		# Cast only against the walls of the camera's region, leaving the
+		# cached frame alone. Returns the region's sprites, None for all.
+		if self.visRegions:
+			region = self.collision.region(player.x, player.y)
+			if 0 <= region < len(self.visRegions):
+				self.caster.setVisible(self.visRegions[region].lines)
+				return self.visRegions[region].sprites
+			self.caster.setVisible(None)
+		return None
+		
+	def textureFrame(self, texture, time):
+		# The real texture drawn for texture number texture at time
+		if texture < len(self.textures):
+			return texture
+		frameSet, start = self.animatedTextures[texture - len(self.textures)]
+		return self.frameSets.frame(frameSet, time - start)
+		
+	def spriteSpan(self, entities, row, fov):
+		# Left and right screen x of a projected entity's scaled image
+		width = self.sprImages[entities.index[row]].get_width() * spriteScale(entities.distance[row], fov)
+		left = entities.screenX[row] - width * entities.offX[row]
+		return left, left + width
+		
+	def drawnSprites(self, entities, fov):
+		# Everything about the projected sprites that shows in the scene.
+		# Sprites off the sides of the screen, or behind the camera, are
+		# left out so they do not stop the scene being reused.
+		drawn = []
+		for i in range(len(entities)):
+			if entities.visible[i]:
+				left, right = self.spriteSpan(entities, i, fov)
+				# A pixel of slack for the rounding of the scaled image
+				if left - 1 < self.screenWidth and right + 1 > 0:
+					drawn.append((entities.index[i], entities.screenX[i], entities.screenY[i], entities.distance[i], entities.offX[i], entities.offY[i]))
+		return drawn
+		
+	def animatedTexture(self, frames, start = 0.0):
+		# Number of a new animated texture playing the texture indices in
+		# frames from time start
+		self.animatedTextures.append((self.frameSets.add(frames), start))
+		return len(self.textures) + len(self.animatedTextures) - 1
+		
+	def moveWall(self, i, line):
+		# Wall i, counting a compiled map's static walls then the lines the
+		# renderer was made with, a DynamicLine, moved or changed texture
+		self.caster.moveWall(i, line)
+		self.wallsChanged()
+		
+	def wallsChanged(self):
+		# Call after moving or retexturing a wall so the next frame casts
+		# again
+		self.wallVersion += 1
+		
+	def projectSprites(self, player, entities, alpha = 1.0, visibleSprites = None, time = 0.0):
+		# Distance, visibility and screen position of every entity, written
+		# into the store's render columns. Entities whose handle is not in
+		# visibleSprites, or whose image could not reach the screen, are
+		# left hidden, and only visible ones are moved on to their animation
+		# frame at time.
+		screenWidth = self.screenWidth
+		resHeight = self.resHeight
+		i = 0
+		while i < len(entities):
+			entities.visible[i] = 0
+			if visibleSprites is not None and entities.handles[i] not in visibleSprites:
+				i += 1
+				continue
+			x = entities.lastX[i] + (entities.x[i] - entities.lastX[i]) * alpha
+			y = entities.lastY[i] + (entities.y[i] - entities.lastY[i]) * alpha
+			if x != player.x:
+				mSpr = (y - player.y)/(x - player.x)
+			else:
+				mSpr = 0
+				
+			distance = math.sqrt((x - player.x)**2 + (y - player.y)**2)
+			angle = 0
+			
+			negX = 0
+			negY = 0
+			if x < player.x:
+				negX = 1
+			if y < player.y:
+				negY = 1
+				
+			if negX:
+				if y == player.y:
+					angle = math.pi
+				else:
+					angle = math.pi + math.atan(mSpr)
+			elif x == player.x:
+				if negY:
+					angle = (3 * math.pi)/2
+				else:
+					angle = math.pi / 2
+			else:
+				if y == player.y:
+					angle = 0
+				elif negY:
+					angle = 2 * math.pi + math.atan(mSpr)
+				else:
+					angle = math.atan(mSpr)
+			#if angle <= player.angle + player.fov / 2 and angle >= player.angle - player.fov / 2:
+			if distance > 0.125:
+				nAngle = angle - (player.angle - player.fov / 2)
+				entities.screenX[i] = screenWidth - ((nAngle / player.fov) * screenWidth)
+				# Any frame is at most the widest image across
+				width = self.widestSprite * spriteScale(distance, player.fov)
+				left = entities.screenX[i] - width * entities.offX[i]
+				if left - 1 < screenWidth and left + width + 1 > 0:
+					entities.visible[i] = 1
+					entities.showFrame(i, time)
+					vertHeight = screenWidth * (math.atan(1 / (distance * math.cos(abs(angle - player.angle)))) / player.fov)
+					entities.screenY[i] = resHeight - (((resHeight - vertHeight) / 2) + (entities.z[i] * vertHeight))
+				
+			entities.distance[i] = distance
+			
+			i += 1
+		
+	def compose(self, screen, player, entities, order, screenLineIndex):
+		# Merge sprites and wall columns back to front
+		resHeight = self.resHeight
+		rectWidth = self.rectWidth
+		sprImages = self.sprImages
+		columnCache = self.columnCache
+		sprites = self.spriteCache
+		rasterizer = self.rasterizer
+		spans = self.spans
+		render = self.render
+		target = render
+		if rasterizer is not None:
+			target = screen
+		drawn = 0
+		misses = columnCache.misses + sprites.misses
+		
+		i = 0
+		j = 0
+		while i < len(order) or j < len(screenLineIndex):
+			if j >= len(screenLineIndex) or (i < len(order) and entities.distance[order[i]] > screenLineIndex[j][0]):
+				row = order[i]
+				if entities.visible[row]:
+					distance = entities.distance[row]
+					sprScale = spriteScale(distance, player.fov)
+					# Skip sprites whose columns are all behind nearer walls
+					sprWidth = sprImages[entities.index[row]].get_width() * sprScale
+					sprLeft = entities.screenX[row] - sprWidth * entities.offX[row]
+					if not spans.isCovered(int(math.floor(sprLeft / rectWidth)) - 1, int(math.ceil((sprLeft + sprWidth) / rectWidth)) + 1, distance):
+						newImage = sprites.get(entities.index[row], sprScale)
+						drawn += 1
+						if rasterizer is not None:
+							# Walls behind this sprite have to be drawn first
+							rasterizer.flush(target)
+						target.blit(newImage, (entities.screenX[row] - newImage.get_width() * entities.offX[row], entities.screenY[row] - newImage.get_height() * entities.offY[row]))
+				i += 1
+			elif j <= len(screenLineIndex):
+				textureX = columnCache.columnIndex(screenLineIndex[j][1], screenLineIndex[j][4])
+				if rasterizer is not None:
+					rasterizer.addColumn(screenLineIndex[j][3] * rectWidth, rectWidth, int((resHeight - screenLineIndex[j][2]) / 2), screenLineIndex[j][2], screenLineIndex[j][1], textureX)
+				else:
+					textVert = columnCache.get(screenLineIndex[j][1], textureX, rectWidth, screenLineIndex[j][2])
+					render.blit(textVert, (screenLineIndex[j][3] * rectWidth, int((resHeight - screenLineIndex[j][2]) / 2)))
+				j += 1
+		
+		if rasterizer is not None:
+			rasterizer.flush(target)
+		else:
+			screen.blit(render, (0, 0))
+		
+		self.profiler.count("sprites", drawn)
+		self.profiler.count("culled sprites", self.spans.spritesCulled)
+		self.profiler.count("surfaces", columnCache.misses + sprites.misses - misses)
+		
+	def composeDepth(self, screen, player, entities, order, screenLineIndex):
+		# Draw the nearest wall in every column, then each sprite back to
+		# front, only in the columns where it is nearer than the wall
+		resHeight = self.resHeight
+		rectWidth = self.rectWidth
+		columnCache = self.columnCache
+		sprites = self.spriteCache
+		rasterizer = self.rasterizer
+		render = self.render
+		drawn = 0
+		misses = columnCache.misses + sprites.misses
+		
+		for entry in screenLineIndex:
+			textureX = columnCache.columnIndex(entry[1], entry[4])
+			if rasterizer is not None:
+				rasterizer.addColumn(entry[3] * rectWidth, rectWidth, int((resHeight - entry[2]) / 2), entry[2], entry[1], textureX)
+			else:
+				render.blit(columnCache.get(entry[1], textureX, rectWidth, entry[2]), (entry[3] * rectWidth, int((resHeight - entry[2]) / 2)))
+		
+		if rasterizer is not None:
+			rasterizer.flush(screen)
+		else:
+			screen.blit(render, (0, 0))
+		
+		for row in order:
+			if not entities.visible[row]:
+				continue
+			distance = entities.distance[row]
+			sprScale = spriteScale(distance, player.fov)
+			# Skip sprites whose columns are all behind nearer walls
+			sprWidth = self.sprImages[entities.index[row]].get_width() * sprScale
+			sprLeft = entities.screenX[row] - sprWidth * entities.offX[row]
+			if self.spans.isCovered(int(math.floor(sprLeft / rectWidth)) - 1, int(math.ceil((sprLeft + sprWidth) / rectWidth)) + 1, distance):
+				continue
+			image = sprites.get(entities.index[row], sprScale)
+			drawn += 1
+			width = image.get_width()
+			left = int(entities.screenX[row] - width * entities.offX[row])
+			top = int(entities.screenY[row] - image.get_height() * entities.offY[row])
+			for start, end in self.spans.openRuns(left // rectWidth, (left + width - 1) // rectWidth + 1, distance):
+				x0 = max(left, start * rectWidth)
+				x1 = min(left + width, end * rectWidth)
+				screen.blit(image, (x0, top), (x0 - left, 0, x1 - x0, image.get_height()))
+		
+		self.profiler.count("sprites", drawn)
+		self.profiler.count("culled sprites", self.spans.spritesCulled)
+		self.profiler.count("surfaces", columnCache.misses + sprites.misses - misses)
+		
+def main(options = None):
+	if options is None:
+		options = parseOptions([])
+		
 	# Key states
 	keys = {"Up":0, "Down":0, "Left":0, "Right":0, "Z":0, "X":0, "Fire":0}
 	
 	# Clock for timing
 	clock = pygame.time.Clock()
 	
-	# Screen height and width
-	resHeight = 240
-	screenWidth = 320
+	# Window height and width
+	resHeight = options.height
+	screenWidth = options.width
+	
+	# Internal render height and width, upscaled to the window
+	renderHeight = options.renderHeight or resHeight
+	renderWidth = options.renderWidth or screenWidth
 	
 	# Set caption
 	pygame.display.set_caption("Ray Casting")
@@ -593,32 +1236,21 @@ def main():
 	screen = pygame.display.set_mode((screenWidth, resHeight))
 	
 	# Background sky/floor image
-	background = pygame.image.load("rcBackground.png")
-	
-	# Where the scene is rendered
-	render = pygame.Surface((screenWidth, resHeight))
-	render.set_colorkey((0, 0, 0))
+	background = pygame.image.load("rcBackground.PNG")
 	
 	# Where hud/weapon are drawn
 	overlay = pygame.Surface((screenWidth, resHeight))
 	overlay.set_colorkey((255, 0, 255))
 	
 	# Simple weapon image
-	gun = pygame.image.load("vwepHandgun1.png")
+	gun = pygame.image.load("vwepHandgun1.PNG")
 	gun.set_colorkey((255, 0, 255))
-	gunFired = pygame.image.load("vwepHandgun2.png")
+	gunFired = pygame.image.load("vwepHandgun2.PNG")
 	gunFired.set_colorkey((255, 0, 255))
 	
 	# Create the player/camera
 	player = Player(0, 0, 0, 0.25 * math.pi, 30)
 	
-	# Width of each vertical division
-	rectWidth = 1
-	
-	rectHeight = 0
-	# Number of divisions
-	resWidth = screenWidth / rectWidth
-	
 	running = 1
 	rendered = 0
 	# A bitmapped font
@@ -651,21 +1283,48 @@ def main():
 	map = []
 	regions = []
 	sprites = []
+	dynamicLines = []
 	
-	loadMap("test.map", sprImages, textures, map, regions, sprites, frameSets)
+	compiled = loadMap(options.map, sprImages, textures, map, regions, sprites, frameSets, dynamicLines)
 	
-	screenLineIndex = []
-	worldSprites = []
+	# Dynamic walls follow the static ones, so dynamic wall k is wall
+	# firstDynamic + k to the renderer
+	firstDynamic = len(map)
+	if compiled is not None:
+		firstDynamic += compiled.wallCount
+	map.extend(dynamicLines)
+	
+	collision = loadCollision(regions, compiled)
+	
+	# Sprites and items as rows of one store, and by cell for player
+	# collisions
+	entities = entityStore.EntityStore()
+	spriteHash = spatialHash.SpatialHash()
+	for handle in loadEntities(entities, sprites, compiled):
+		row = entities.row(handle)
+		spriteHash.insert(handle, entities.x[row], entities.y[row], entities.r[row])
+	
+	# Stage timings and counters, shown on the HUD with F3
+	profiler = frameProfiler.FrameProfiler()
+	
+	renderer = Renderer(renderWidth, renderHeight, options.rectWidth, textures, sprImages, map, background, options, profiler, compiled)
+	renderer.setVisibility(collision, loadVisRegions(compiled))
 	
 	for image in sprImages:
 		image.set_colorkey((255, 0, 255))
 	
-	i = 0
-	while i < len(sprites):
-		worldSprites.append([player.clip, 0, sprites[i]])
-		i += 1
+	# Game time not yet simulated, steps taken, and the camera before the
+	# last step
+	accumulator = 0.0
+	steps = 0
+	lastTime = timeit.default_timer()
+	lastX = player.x
+	lastY = player.y
+	lastAngle = player.angle
 	
 	while running:
+		profiler.beginFrame()
+		
 		# Flag for if we want a screen shot
 		screenRequest = 0
 		for event in pygame.event.get():
@@ -690,6 +1349,8 @@ def main():
 					keys["Fire"] = 1
 				elif event.key == pygame.K_F12:
 					screenRequest = 1
+				elif event.key == pygame.K_F3:
+					profiler.toggle()
 			elif event.type == pygame.KEYUP:
 				if event.key == pygame.K_UP:
 					keys["Up"] = 0
@@ -706,320 +1367,217 @@ def main():
 				elif event.key == pygame.K_SPACE:
 					keys["Fire"] = 0
 				
-		if keys["Up"]:
-			# Move forwards
-			oldx = player.x
-			player.x += math.cos(player.angle) / 8
-			#for block in blocks:
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.x = oldx
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+		profiler.lap("input")
+		
+		# Advance the game in fixed steps for the real time that passed,
+		# whatever the frame rate
+		now = timeit.default_timer()
+		accumulator += min(now - lastTime, MAX_LAG)
+		lastTime = now
+		while accumulator >= STEP:
+			# Remember where everything was, for interpolation
+			lastX = player.x
+			lastY = player.y
+			lastAngle = player.angle
+			entities.snapshot()
+			
+			if keys["Up"]:
+				# Move forwards
+				oldx = player.x
+				player.x += math.cos(player.angle) / 8
+				#for block in blocks:
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.x = oldx
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.x = oldx
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+							
 						
-					
-			oldy = player.y
-			player.y += math.sin(player.angle) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.y = oldy
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+				oldy = player.y
+				player.y += math.sin(player.angle) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.y = oldy
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.y = oldy
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-					
-		if keys["Down"]:
-			# Move backwards
-			oldx = player.x
-			player.x -= math.cos(player.angle) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.x = oldx
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+						
+			if keys["Down"]:
+				# Move backwards
+				oldx = player.x
+				player.x -= math.cos(player.angle) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.x = oldx
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.x = oldx
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-							
-			oldy = player.y
-			player.y -= math.sin(player.angle) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.y = oldy
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+								
+				oldy = player.y
+				player.y -= math.sin(player.angle) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.y = oldy
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.y = oldy
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-							
-		if keys["Left"]:
-			# Turn left
-			player.angle += math.pi / 36
-			
-			# Keep angle within 0 - 2pi
-			while player.angle > 2 * math.pi:
-				player.angle -= 2 * math.pi
-					
-		if keys["Right"]:
-			# Turn right
-			player.angle -= math.pi / 36
-			
-			# Keep angle within 0 - 2pi
-			while player.angle < 0:
-				player.angle += 2 * math.pi
-			
-		if keys["Z"]:
-			# Strafe left
-			oldx = player.x
-			player.x += math.cos(player.angle + math.pi / 2) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.x = oldx
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+								
+			if keys["Left"]:
+				# Turn left
+				player.angle += math.pi / 36
+				
+				# Keep angle within 0 - 2pi
+				while player.angle > 2 * math.pi:
+					player.angle -= 2 * math.pi
+						
+			if keys["Right"]:
+				# Turn right
+				player.angle -= math.pi / 36
+				
+				# Keep angle within 0 - 2pi
+				while player.angle < 0:
+					player.angle += 2 * math.pi
+				
+			if keys["Z"]:
+				# Strafe left
+				oldx = player.x
+				player.x += math.cos(player.angle + math.pi / 2) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.x = oldx
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.x = oldx
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-					
-			oldy = player.y
-			player.y += math.sin(player.angle + math.pi / 2) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.y = oldy
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+						
+				oldy = player.y
+				player.y += math.sin(player.angle + math.pi / 2) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.y = oldy
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.y = oldy
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-					
-		if keys["X"]:
-			# Strafe right
-			oldx = player.x
-			player.x += math.cos(player.angle - math.pi / 2) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.x = oldx
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+						
+			if keys["X"]:
+				# Strafe right
+				oldx = player.x
+				player.x += math.cos(player.angle - math.pi / 2) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.x = oldx
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.x = oldx
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-					
-			oldy = player.y
-			player.y += math.sin(player.angle - math.pi / 2) / 8
-			if len(regions) > 0 and not [r for r in regions if r.isInside((player.x, player.y))]:
-				player.y = oldy
-			for sprite in sprites:
-				if player.r + sprite.r > math.sqrt((player.x - sprite.x)**2 + (player.y - sprite.y)**2):
-					if sprite.type == 0:
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
+						
+				oldy = player.y
+				player.y += math.sin(player.angle - math.pi / 2) / 8
+				if collision.count > 0 and not collision.isInside(player.x, player.y):
+					player.y = oldy
+				for handle in spriteHash.query(player.x, player.y, player.r):
+					entityType = entities.type[entities.row(handle)]
+					if entityType == 0:
 						player.y = oldy
 						break
 					else:
-						sprites.remove(sprite)
-						worldSprites = updateSpriteList(sprites)
-						messageBox.addLine(itemMessages[sprite.type])
-					
-		if keys["Fire"] and not reloadTime:
-			frameDel = 5
-			reloadTime = RELOAD
-					
-		# Reset divCount and clear surfaces for rendering		
-		divCount = 0
-		screen.blit(background, (0, 0))
-		render.fill((0, 0, 0))
-		overlay.fill((255, 0, 255))
-		
-		screenLineIndex = []
-		
-		# Render the scene
-		while divCount < resWidth:
-			# Calculate the rays angle
-			angle = player.angle + player.fov / 2
-			angle -= (player.fov / resWidth) * divCount
-			rX = player.x
-			rY = player.y
-			negX = 0
-			negY = 0
-			if angle != math.pi / 2 and angle != (3 * math.pi) / 2:
-				rM = math.tan(angle)
-				rB = rY - rM * rX
-				rVertical = 0
-			else:
-				rM = 0
-				rVertical = 1
-			
-			if math.cos(angle) < 0:
-				negX = 1
-			if math.sin(angle) < 0:
-				negY = 1
-			cross = (-1, 0, 0, 0)
-			distance = player.clip
-			index = 0
-			for line in map:
-				found = 0
-				if rVertical:
-					newCross = line.intersectionVertical(rX)
-				else:
-					newCross = line.intersectionSlopeInt(rM, rB)
-				
-				if newCross[0] != -1:
-					newDist = math.sqrt((rX - newCross[1])**2 + (rY - newCross[2])**2)
-					if newDist < player.clip:
-						if negX and newCross[1] < rX:
-							if negY and newCross[2] < rY:
-								found = 1
-							elif not negY and newCross[2] > rY:
-								found = 1
-						elif not negX and newCross[1] > rX:
-							if negY and newCross[2] < rY:
-								found = 1
-							elif not negY and newCross[2] > rY:
-								found = 1
-							
-					if found:
-						cross = newCross
-						distance = newDist
+						entities.remove(handle)
+						spriteHash.remove(handle)
+						messageBox.addLine(itemMessages[entityType])
 						
-						texture = cross[0]
-						textVert = cross[3]
-						if texture != -1:
-							# Calculate height of the vertical
-							rectHeight = screenWidth * (math.atan(1 / (distance * math.cos(abs(angle - player.angle)))) / player.fov)
-						else:
-							rectHeight = 0
-				
-						# Store vertical in list
-						screenLineIndex.append((distance, texture, rectHeight, divCount, textVert))
+			if frameDel:
+				frameDel -= 1
 			
-			# Next vertical division
-			divCount += 1
-		
-		i = 0
-		while i < len(worldSprites):
-			worldSprites[i][1] = 0
-			if worldSprites[i][2].x != player.x:
-				mSpr = (worldSprites[i][2].y - player.y)/(worldSprites[i][2].x - player.x)
-			else:
-				mSpr = 0
-				
-			distance = math.sqrt((worldSprites[i][2].x - player.x)**2 + (worldSprites[i][2].y - player.y)**2)
-			angle = 0
+			if keys["Fire"] and not reloadTime:
+				frameDel = 5
+				reloadTime = RELOAD
 			
-			negX = 0
-			negY = 0
-			if worldSprites[i][2].x < player.x:
-				negX = 1
-			if worldSprites[i][2].y < player.y:
-				negY = 1
-				
-			if negX:
-				if worldSprites[i][2].y == player.y:
-					angle = math.pi
-				else:
-					angle = math.pi + math.atan(mSpr)
-			elif worldSprites[i][2].x == player.x:
-				if negY:
-					angle = (3 * math.pi)/2
-				else:
-					angle = math.pi / 2
-			else:
-				if worldSprites[i][2].y == player.y:
-					angle = 0
-				elif negY:
-					angle = 2 * math.pi + math.atan(mSpr)
-				else:
-					angle = math.atan(mSpr)
-			#if angle <= player.angle + player.fov / 2 and angle >= player.angle - player.fov / 2:
-			if distance > 0.125:
-				worldSprites[i][1] = 1
-				nAngle = angle - (player.angle - player.fov / 2)
-				worldSprites[i][2].screenX = screenWidth - ((nAngle / player.fov) * screenWidth)
-				vertHeight = screenWidth * (math.atan(1 / (distance * math.cos(abs(angle - player.angle)))) / player.fov)
-				worldSprites[i][2].screenY = resHeight - (((resHeight - vertHeight) / 2) + (worldSprites[i][2].z * vertHeight))
-				
-			worldSprites[i][0] = distance
+			messageBox.tick()
 			
-			i += 1
-		
-		qSort(worldSprites)
-		qSort(screenLineIndex)
+			if reloadTime > 0:
+				reloadTime -= 1
+			
+			for k, line in enumerate(dynamicLines):
+				if line.update():
+					renderer.moveWall(firstDynamic + k, line)
+			
+			accumulator -= STEP
+			steps += 1
 		
-		i = 0
-		j = 0
-		while i < len(worldSprites) or j < len(screenLineIndex):
-			if j >= len(screenLineIndex) or (i < len(worldSprites) and worldSprites[i][0] > screenLineIndex[j][0]):
-				if worldSprites[i][1]:
-					sprScale = worldSprites[i][2].getScale(worldSprites[i][0], player.fov)
-					newImage = pygame.transform.rotozoom(sprImages[worldSprites[i][2].index], 0, sprScale)
-					newImage.set_colorkey((255, 0, 255))
-					render.blit(newImage, (worldSprites[i][2].screenX - newImage.get_width() * worldSprites[i][2].offX, worldSprites[i][2].screenY - newImage.get_height() * worldSprites[i][2].offY))
-				i += 1
-			elif j <= len(screenLineIndex):
-				textureX = screenLineIndex[j][4] * textures[screenLineIndex[j][1]].get_width()
-				if textureX >= textures[screenLineIndex[j][1]].get_width():
-					textureX = textures[screenLineIndex[j][1]]. get_width() - 1
-				if textureX < 0:
-					textureX = 0
-				textVert = textures[screenLineIndex[j][1]].subsurface((textureX, 0, 1, textures[screenLineIndex[j][1]].get_height()))
-				textVert = pygame.transform.smoothscale(textVert, (rectWidth, int(screenLineIndex[j][2])))
-				render.blit(textVert, (screenLineIndex[j][3] * rectWidth, int((resHeight - screenLineIndex[j][2]) / 2)))
-				j += 1
+		profiler.lap("update")
+					
+		# Render the scene between the last two steps
+		alpha = accumulator / STEP
+		overlay.fill((255, 0, 255))
+		renderer.renderFrame(screen, cameraBetween(lastX, lastY, lastAngle, player, alpha), entities, alpha, steps * STEP)
 		
 		i = -len(messageBox.messages)
 		while i < 0:
 			font.bitmapPrint(overlay, messageBox.x, messageBox.y + (-i - 1) * font.subHeight, messageBox.messages[i], (0, 255, 0))
 			i += 1
 		
-		screen.blit(render, (0, 0))
+		profiler.draw(font, overlay, messageBox.x, messageBox.y + (messageBox.lines + 1) * font.height)
 		screen.blit(overlay, (0, 0))
 		
-		messageBox.tick()
-		
 		if frameDel:
 			screen.blit(gunFired, (screenWidth / 2 - 48, resHeight - 96))
-			frameDel -= 1
 		else:
 			screen.blit(gun, (screenWidth / 2 - 48, resHeight - 96))
 		
-		if reloadTime > 0:
-			reloadTime -= 1
-		
-		for sprite in sprites:
-			if sprite.type == 2:
-				sprite.update()
+		profiler.lap("hud")
 		
 		# Save a screenshot if F12 was pressed
 		if screenRequest:
 			pygame.image.save(screen, "rc10Screenshot%d.png" % (imgSaves,))
 			imgSaves += 1
+			profiler.skip()
 		
 		pygame.display.flip()
-		clock.tick(30)
+		profiler.lap("flip")
+		profiler.endFrame()
+		renderer.adapt(profiler.frameTime)
+		# A reused scene cannot change again before the next game step, so
+		# there is no point drawing faster than the steps come
+		fps = options.fps
+		if renderer.reused and (fps == 0 or fps > STEP_RATE):
+			fps = STEP_RATE
+		clock.tick(fps)
+	
+	renderer.close()
 		
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main(parseOptions())
\ No newline at end of file
@@ -0,0 +1,50 @@
+# Ray helpers shared by the wall casting engines
+
+import math
+
+class Ray:
+	# A single column ray from (x, y) along the unit vector (cosAngle, sinAngle)
+	def __init__(self, x, y, cosAngle, sinAngle, clip):
+		self.x = x
+		self.y = y
+		self.cosAngle = cosAngle
+		self.sinAngle = sinAngle
+		self.clip = clip
+
+def angleRay(x, y, angle, clip):
+	return Ray(x, y, math.cos(angle), math.sin(angle), clip)
+
+class ColumnTables:
+	# Per column lookup tables for one (resWidth, fov, screenWidth). Column i
+	# looks offset[i] radians left of the camera direction, so its ray is the
+	# camera direction rotated by the offset, i.e. cos(offset) along the
+	# direction plus sin(offset) along the camera plane. cos(offset) is also
+	# the fisheye correction for the column.
+	def __init__(self, resWidth, fov, screenWidth):
+		self.key = (resWidth, fov, screenWidth)
+		step = fov / resWidth
+		self.offset = [fov / 2 - step * i for i in range(int(math.ceil(resWidth)))]
+		self.cosOffset = [math.cos(offset) for offset in self.offset]
+		self.sinOffset = [math.sin(offset) for offset in self.offset]
+		# Projected height is heightScale * atan(1 / perpendicular distance)
+		self.heightScale = screenWidth / fov
+
+	def directions(self, player, first, last):
+		# Unit ray directions of columns first to last - 1 as lists of x and y
+		cosAngle = math.cos(player.angle)
+		sinAngle = math.sin(player.angle)
+		cosOffset = self.cosOffset[first:last]
+		sinOffset = self.sinOffset[first:last]
+		xs = [cosAngle * c - sinAngle * s for c, s in zip(cosOffset, sinOffset)]
+		ys = [sinAngle * c + cosAngle * s for c, s in zip(cosOffset, sinOffset)]
+		return xs, ys
+
+	def height(self, column, distance):
+		# Projected height of a wall hit distance away along column's ray
+		return self.heightScale * math.atan(1 / (distance * self.cosOffset[column]))
+
+def columnTables(tables, player, resWidth, screenWidth):
+	# tables if they were built for this resolution and fov, otherwise new ones
+	if tables is None or tables.key != (resWidth, player.fov, screenWidth):
+		tables = ColumnTables(resWidth, player.fov, screenWidth)
+	return tables
@@ -0,0 +1,96 @@
+# 1-D coverage buffer for the screen columns
+# Tracks which columns are already closed by a nearer opaque wall so hidden
+# wall columns and sprites are dropped before any texture work
+
+class SpanBuffer:
+	def __init__(self, width):
+		self.width = int(width)
+		self.clear()
+
+	def clear(self):
+		# Nearest opaque wall per column, None while the column is open
+		self.depth = [None] * self.width
+		# Counters for the walls cast into it
+		self.wallColumns = 0
+		self.wallsCulled = 0
+		self.clearSprites()
+
+	def clearSprites(self):
+		# Per-frame sprite counters. The columns can be kept over several
+		# frames, so these are cleared on their own.
+		self.sprites = 0
+		self.spritesCulled = 0
+		self.spritesOffScreen = 0
+
+	def cull(self, screenLineIndex):
+		# Close each column at its nearest wall and return only the entries
+		# that are not hidden behind it
+		depth = self.depth
+		for entry in screenLineIndex:
+			column = entry[3]
+			if depth[column] is None or entry[0] < depth[column]:
+				depth[column] = entry[0]
+
+		visible = [entry for entry in screenLineIndex if entry[0] <= depth[entry[3]]]
+		self.wallColumns += len(screenLineIndex)
+		self.wallsCulled += len(screenLineIndex) - len(visible)
+		return visible
+
+	def spans(self):
+		# Closed columns as a list of (start, end) runs, end exclusive
+		runs = []
+		start = None
+		column = 0
+		while column < self.width:
+			if self.depth[column] is not None:
+				if start is None:
+					start = column
+			elif start is not None:
+				runs.append((start, column))
+				start = None
+			column += 1
+		if start is not None:
+			runs.append((start, self.width))
+		return runs
+
+	def isCovered(self, left, right, distance):
+		# True if columns left..right-1 are all closed nearer than distance.
+		# Anything entirely off screen counts as covered, but is counted
+		# apart from the sprites hidden behind walls.
+		self.sprites += 1
+		left = max(0, left)
+		right = min(self.width, right)
+		if left >= right:
+			self.spritesOffScreen += 1
+			return 1
+		covered = 1
+		column = left
+		while column < right:
+			if self.depth[column] is None or self.depth[column] >= distance:
+				covered = 0
+				break
+			column += 1
+		if covered:
+			self.spritesCulled += 1
+		return covered
+
+	def openRuns(self, left, right, distance):
+		# Runs of columns left..right-1 not closed nearer than distance, as
+		# (start, end) pairs with end exclusive. This is the part of a sprite
+		# at that distance that shows.
+		left = max(0, left)
+		right = min(self.width, right)
+		runs = []
+		start = None
+		column = left
+		while column < right:
+			if self.depth[column] is None or self.depth[column] >= distance:
+				if start is None:
+					start = column
+			elif start is not None:
+				runs.append((start, column))
+				start = None
+			column += 1
+		if start is not None:
+			runs.append((start, right))
+		return runs
@@ -0,0 +1,79 @@
+# Broad phase spatial hash for sprites and items
+# Buckets circles by the cell holding their centre so queries only look at
+# the neighbouring cells instead of every object on the level
+
+import math
+
+class SpatialHash:
+	# Stores circles under a caller chosen key, e.g. an entity handle. Each
+	# cell is a dict of key: (x, y, r) so insert, move and remove are all
+	# constant time.
+	def __init__(self, cellSize = 1.0):
+		self.cellSize = float(cellSize)
+		self.cells = {}
+		# Cell of every key in the hash
+		self.keys = {}
+		# Largest radius inserted, which bounds how far a query has to reach
+		self.maxRadius = 0.0
+		# Candidates tested by queries since the counter was last reset
+		self.tested = 0
+
+	def cell(self, x, y):
+		return (int(math.floor(x / self.cellSize)), int(math.floor(y / self.cellSize)))
+
+	def insert(self, key, x, y, r):
+		cellKey = self.cell(x, y)
+		cell = self.cells.get(cellKey)
+		if cell is None:
+			cell = {}
+			self.cells[cellKey] = cell
+		cell[key] = (x, y, r)
+		self.keys[key] = cellKey
+		if r > self.maxRadius:
+			self.maxRadius = r
+
+	def remove(self, key):
+		cellKey = self.keys.pop(key, None)
+		if cellKey is None:
+			return
+		cell = self.cells[cellKey]
+		del cell[key]
+		if not cell:
+			del self.cells[cellKey]
+
+	def move(self, key, x, y):
+		cellKey = self.keys[key]
+		r = self.cells[cellKey][key][2]
+		if self.cell(x, y) == cellKey:
+			self.cells[cellKey][key] = (x, y, r)
+		else:
+			self.remove(key)
+			self.insert(key, x, y, r)
+
+	def __len__(self):
+		return len(self.keys)
+
+	def query(self, x, y, r):
+		# Keys whose circle overlaps the circle (x, y, r), compared on
+		# squared distances. Returns a new list, so callers may remove what
+		# they find while looping over it.
+		reach = r + self.maxRadius
+		cx0, cy0 = self.cell(x - reach, y - reach)
+		cx1, cy1 = self.cell(x + reach, y + reach)
+		found = []
+		tested = 0
+		cells = self.cells
+		for cx in range(cx0, cx1 + 1):
+			for cy in range(cy0, cy1 + 1):
+				cell = cells.get((cx, cy))
+				if cell is None:
+					continue
+				for key, (objX, objY, objR) in cell.items():
+					tested += 1
+					dx = x - objX
+					dy = y - objY
+					limit = r + objR
+					if dx * dx + dy * dy < limit * limit:
+						found.append(key)
+		self.tested += tested
+		return found
@@ -0,0 +1,85 @@
+# Scaled sprite cache
+# Builds a mip pyramid of each sprite image at load time and keeps recently
+# used scaled copies so sprites are not rotozoomed every frame
+
+import math
+import pygame
+from collections import OrderedDict
+
+class SpriteCache:
+	def __init__(self, images, budget = 4 * 1024 * 1024, steps = 16, colorkey = (255, 0, 255)):
+		# budget is the most bytes of scaled sprites kept at once, steps the
+		# number of scales kept per doubling of size
+		self.budget = budget
+		self.steps = max(1, int(steps))
+		self.colorkey = colorkey
+		self.size = 0
+		self.scaled = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.setImages(images)
+
+	def setImages(self, images):
+		# Each image halved down to a single pixel row or column, in the
+		# display's pixel format if a display mode is set
+		self.images = images
+		self.levels = []
+		for image in images:
+			if not pygame.display.get_init() or pygame.display.get_surface() is None:
+				# Rendering off screen, there is no format to match
+				level = image.copy()
+			elif image.get_flags() & pygame.SRCALPHA:
+				level = image.convert_alpha()
+			else:
+				level = image.convert()
+			level.set_colorkey(self.colorkey)
+			pyramid = [level]
+			while level.get_width() > 1 and level.get_height() > 1:
+				level = pygame.transform.smoothscale(level, (level.get_width() // 2, level.get_height() // 2))
+				level.set_colorkey(self.colorkey)
+				pyramid.append(level)
+			self.levels.append(pyramid)
+		self.clear()
+
+	def clear(self):
+		self.scaled.clear()
+		self.size = 0
+
+	def get(self, index, scale):
+		# Image index scaled by about scale, rounded to the nearest step
+		step = int(round(math.log(scale, 2) * self.steps))
+		key = (index, step)
+		image = self.scaled.pop(key, None)
+		if image is not None:
+			self.hits += 1
+			self.scaled[key] = image
+			return image
+
+		self.misses += 1
+		scale = 2 ** (float(step) / self.steps)
+		# Zoom from the smallest level that is still at least as large
+		pyramid = self.levels[index]
+		width = pyramid[0].get_width()
+		level = pyramid[0]
+		for candidate in pyramid:
+			if candidate.get_width() < width * scale:
+				break
+			level = candidate
+		image = pygame.transform.rotozoom(level, 0, scale * width / level.get_width())
+		image.set_colorkey(self.colorkey)
+		cost = image.get_width() * image.get_height() * image.get_bytesize()
+		if cost <= self.budget:
+			self.scaled[key] = image
+			self.size += cost
+			while self.size > self.budget:
+				oldKey, oldImage = self.scaled.popitem(last = False)
+				self.size -= oldImage.get_width() * oldImage.get_height() * oldImage.get_bytesize()
+				self.evictions += 1
+		return image
+
+	def hitRate(self):
+		total = self.hits + self.misses
+		if total == 0:
+			return 0.0
+		return float(self.hits) / total
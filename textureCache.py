@@ -0,0 +1,76 @@
+# Texture column cache
+# Slices each wall texture into 1 pixel columns once at load time and keeps
+# recently used scaled columns so steady frames allocate almost nothing
+
+import pygame
+from collections import OrderedDict
+
+class TextureColumnCache:
+	def __init__(self, textures, budget = 8 * 1024 * 1024, quantum = 1):
+		# budget is the most bytes of scaled columns kept at once, quantum
+		# the height step scaled columns are rounded down to
+		self.budget = budget
+		self.quantum = max(1, int(quantum))
+		self.size = 0
+		self.scaled = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.setTextures(textures)
+
+	def setTextures(self, textures):
+		self.textures = textures
+		self.columns = []
+		for texture in textures:
+			self.columns.append([self.slice(texture, x) for x in range(texture.get_width())])
+		self.clear()
+
+	def slice(self, texture, x):
+		# Column x of a texture without its alpha channel. Walls are opaque,
+		# and shrinking an RGBA column leaves its alpha just under 255, which
+		# would blend it with whatever it is drawn over.
+		column = pygame.Surface((1, texture.get_height()), 0, 32)
+		column.blit(texture, (0, 0), (x, 0, 1, texture.get_height()))
+		return column
+
+	def clear(self):
+		self.scaled.clear()
+		self.size = 0
+
+	def columnIndex(self, texture, texVert):
+		# Texture column for a 0 - 1 texture coordinate, clamped to the image
+		width = len(self.columns[texture])
+		textureX = int(texVert * width)
+		if textureX >= width:
+			textureX = width - 1
+		if textureX < 0:
+			textureX = 0
+		return textureX
+
+	def get(self, texture, textureX, width, height):
+		# Column textureX of a texture scaled to width x height
+		height = int(height) // self.quantum * self.quantum
+		key = (texture, textureX, width, height)
+		column = self.scaled.pop(key, None)
+		if column is not None:
+			self.hits += 1
+			self.scaled[key] = column
+			return column
+
+		self.misses += 1
+		column = pygame.transform.smoothscale(self.columns[texture][textureX], (width, height))
+		cost = width * height * column.get_bytesize()
+		if cost <= self.budget:
+			self.scaled[key] = column
+			self.size += cost
+			while self.size > self.budget:
+				oldKey, oldColumn = self.scaled.popitem(last = False)
+				self.size -= oldColumn.get_width() * oldColumn.get_height() * oldColumn.get_bytesize()
+				self.evictions += 1
+		return column
+
+	def hitRate(self):
+		total = self.hits + self.misses
+		if total == 0:
+			return 0.0
+		return float(self.hits) / total
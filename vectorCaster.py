@@ -0,0 +1,143 @@
+# Vectorized wall intersection engine
+# Solves every screen column against every wall in batched NumPy steps
+
+import math
+import numpy
+import rays
+
+class VectorCaster:
+	# Walls are held as flat arrays so each frame is a handful of array
+	# operations instead of resWidth * len(lines) Python calls. The maths is
+	# the same parametric form WallStore.hit uses, so results match LineCaster.
+	def __init__(self, walls, chunkSize = 4096):
+		self.chunkSize = chunkSize
+		# Column tables of the last cast, and their offsets as arrays
+		self.tables = None
+		self.cosOffset = None
+		self.sinOffset = None
+		# Rays cast and walls tested by the last cast
+		self.rays = 0
+		self.tested = 0
+		self.setWalls(walls)
+
+	def setWalls(self, walls):
+		# Copies of the store's arrays, so the store can still grow
+		self.walls = walls
+		self.wallArrays = [numpy.array(walls.x1, dtype = numpy.float64), numpy.array(walls.y1, dtype = numpy.float64), numpy.array(walls.dx, dtype = numpy.float64), numpy.array(walls.dy, dtype = numpy.float64), numpy.array(walls.tile, dtype = numpy.float64), numpy.array(walls.texture, dtype = numpy.int32)]
+		self.visible = None
+		self.visibleRows = None
+		self.x1, self.y1, self.dx, self.dy, self.tile, self.texture = self.wallArrays
+
+	def setVisible(self, visible):
+		# Test only the walls whose indices are in visible, or all of them
+		# for None. The arrays are cut again only when the list changes.
+		if visible is self.visible:
+			return
+		self.visible = visible
+		arrays = self.wallArrays
+		# Row of each visible wall in the cut arrays
+		self.visibleRows = None
+		if visible is not None:
+			index = numpy.array(visible, dtype = numpy.intp)
+			arrays = [array[index] for array in arrays]
+			self.visibleRows = dict((wall, row) for row, wall in enumerate(visible))
+		self.x1, self.y1, self.dx, self.dy, self.tile, self.texture = arrays
+
+	def moveWall(self, i, line):
+		# Refresh wall i after it moved or changed texture, in place in the
+		# full arrays and in the cut ones if it is visible
+		walls = self.walls
+		walls.set(i, line)
+		row = (walls.x1[i], walls.y1[i], walls.dx[i], walls.dy[i], walls.tile[i], walls.texture[i])
+		for array, value in zip(self.wallArrays, row):
+			array[i] = value
+		if self.visibleRows is not None and i in self.visibleRows:
+			cut = self.visibleRows[i]
+			for array, value in zip((self.x1, self.y1, self.dx, self.dy, self.tile, self.texture), row):
+				array[cut] = value
+
+	def setTables(self, player, resWidth, screenWidth):
+		tables = rays.columnTables(self.tables, player, resWidth, screenWidth)
+		if tables is not self.tables:
+			self.tables = tables
+			self.cosOffset = numpy.array(tables.cosOffset)
+			self.sinOffset = numpy.array(tables.sinOffset)
+		return tables
+
+	def castColumns(self, player, resWidth, screenWidth, first = 0, last = None):
+		# Returns per column arrays of (distance, texture, texVert, height)
+		# for the nearest wall in columns first to last - 1. Columns with no
+		# hit have texture -1.
+		if last is None:
+			last = resWidth
+		columnCount = int(last - first)
+		wallCount = len(self.texture)
+		self.rays = columnCount
+		self.tested = columnCount * wallCount
+		tables = self.setTables(player, resWidth, screenWidth)
+		cosOffset = self.cosOffset[first:last]
+		sinOffset = self.sinOffset[first:last]
+		rX = float(player.x)
+		rY = float(player.y)
+		# Camera direction rotated by each column's offset
+		cosPlayer = math.cos(player.angle)
+		sinPlayer = math.sin(player.angle)
+		cosAngle = (cosPlayer * cosOffset - sinPlayer * sinOffset)[:, None]
+		sinAngle = (sinPlayer * cosOffset + cosPlayer * sinOffset)[:, None]
+
+		distance = numpy.full(columnCount, float(player.clip))
+		texture = numpy.full(columnCount, -1, dtype = numpy.int32)
+		texVert = numpy.zeros(columnCount)
+
+		start = 0
+		while start < wallCount:
+			end = min(start + self.chunkSize, wallCount)
+			self.castChunk(start, end, player, rX, rY, cosAngle, sinAngle, distance, texture, texVert)
+			start = end
+
+		height = numpy.zeros(columnCount)
+		hit = texture != -1
+		height[hit] = tables.heightScale * numpy.arctan(1 / (distance[hit] * cosOffset[hit]))
+		return distance, texture, texVert, height
+
+	def castChunk(self, start, end, player, rX, rY, cosAngle, sinAngle, distance, texture, texVert):
+		dx = self.dx[start:end]
+		dy = self.dy[start:end]
+		ax = self.x1[start:end] - rX
+		ay = self.y1[start:end] - rY
+
+		with numpy.errstate(divide = "ignore", invalid = "ignore"):
+			denom = cosAngle * dy - sinAngle * dx
+			t = (ax * dy - ay * dx) / denom
+			s = (ax * sinAngle - ay * cosAngle) / denom
+			valid = (denom != 0) & (t > 0) & (t < player.clip) & (s >= 0) & (s <= 1)
+
+		newDist = numpy.where(valid, t, numpy.inf)
+		nearest = numpy.argmin(newDist, axis = 1)
+		columns = numpy.arange(newDist.shape[0])
+		best = newDist[columns, nearest]
+		closer = best < distance
+		if not closer.any():
+			return
+
+		cols = columns[closer]
+		walls = nearest[closer]
+		wall = walls + start
+		v = (1 - s[cols, walls]) * self.tile[wall]
+		v = numpy.where(v > 1, v - (numpy.ceil(v) - 1), v)
+
+		distance[cols] = best[closer]
+		texture[cols] = self.texture[wall]
+		texVert[cols] = v
+
+	def cast(self, player, resWidth, screenWidth):
+		# Same entries as LineCaster.cast, but only the visible wall per column
+		return self.castRange(player, resWidth, screenWidth, 0, resWidth)
+
+	def castRange(self, player, resWidth, screenWidth, first, last):
+		distance, texture, texVert, height = self.castColumns(player, resWidth, screenWidth, first, last)
+		screenLineIndex = []
+		for i in numpy.flatnonzero(texture != -1).tolist():
+			screenLineIndex.append((float(distance[i]), int(texture[i]), float(height[i]), first + i, float(texVert[i])))
+
+		return screenLineIndex
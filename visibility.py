@@ -0,0 +1,203 @@
+# Potentially visible sets
+# Offline pass that finds, for each collision region, the walls and sprites
+# that can be seen from somewhere inside it. Points are sampled over the
+# region's triangles and the walls seen from each are found through a
+# WallGrid. Walls are only seen up to the camera's clip distance, so each
+# point only looks at the walls in the grid cells within that reach.
+
+import math
+import bisect
+import rays
+
+# Sample points are pulled this fraction of the way to their triangle's
+# centre, so none sits exactly on a wall
+INSET = 1e-3
+# Sprites are checked at their centre and this far to each side, since
+# their images are wider than their collision radius
+SPRITE_REACH = 0.5
+# An end point must be this much further than a wall to count as behind it
+BEHIND = 1e-9
+# Clip distance of the game's camera, Player.clip, past which no wall is
+# drawn
+CLIP = 30.0
+
+def samplePoints(triangle, spacing):
+	# Points over a triangle (x1, y1, x2, y2, x3, y3) about spacing apart,
+	# corners and edges included
+	ax, ay, bx, by, cx, cy = triangle
+	longest = max(math.hypot(bx - ax, by - ay), math.hypot(cx - bx, cy - by), math.hypot(ax - cx, ay - cy))
+	n = max(1, int(math.ceil(longest / spacing)))
+	gx = (ax + bx + cx) / 3.0
+	gy = (ay + by + cy) / 3.0
+	points = []
+	for i in range(n + 1):
+		for j in range(n + 1 - i):
+			u = float(i) / n
+			v = float(j) / n
+			w = 1 - u - v
+			x = ax * w + bx * u + cx * v
+			y = ay * w + by * u + cy * v
+			points.append((x + (gx - x) * INSET, y + (gy - y) * INSET))
+	return points
+
+def lineOfSight(grid, x0, y0, x1, y1):
+	distance = math.hypot(x1 - x0, y1 - y0)
+	if distance == 0:
+		return 1
+	ray = rays.Ray(x0, y0, (x1 - x0) / distance, (y1 - y0) / distance, distance)
+	return grid.trace(ray) is None
+
+def wallEnds(store, walls, x, y, clip):
+	# End points of walls, and the points where they cross the circle of
+	# radius clip around (x, y)
+	ends = []
+	clipSq = clip * clip
+	for i in walls:
+		x1 = store.x1[i]
+		y1 = store.y1[i]
+		dx = store.dx[i]
+		dy = store.dy[i]
+		ends.append((x1, y1))
+		ends.append((x1 + dx, y1 + dy))
+		# |(x1, y1) + s * (dx, dy) - (x, y)| = clip for s in 0..1
+		ax = x1 - x
+		ay = y1 - y
+		a = dx * dx + dy * dy
+		b = 2 * (ax * dx + ay * dy)
+		c = ax * ax + ay * ay - clipSq
+		disc = b * b - 4 * a * c
+		if a > 0 and disc > 0:
+			root = math.sqrt(disc)
+			for s in ((-b - root) / (2 * a), (-b + root) / (2 * a)):
+				if 0 < s < 1:
+					ends.append((x1 + dx * s, y1 + dy * s))
+	return ends
+
+class PointView:
+	# Walls seen from (x, y) within clip. Which wall is nearest only changes
+	# at the angle of some wall end point, or where a wall crosses the clip
+	# circle, so the nearest wall in each gap between the sorted angles of
+	# those points finds every visible wall. One ray through the middle of
+	# a gap finds its wall, which then also covers the following gaps for
+	# as long as the points between them are behind it, so hidden points
+	# cost a hit test each rather than a ray. walls must hold every wall
+	# that comes within clip of the point.
+	def __init__(self, grid, x, y, walls, clip = CLIP):
+		self.grid = grid
+		self.x = x
+		self.y = y
+		self.clip = clip
+		# Sorted end point angles, each with its nearest end point's
+		# distance, and the nearest wall in the gap after each, -1 for none
+		self.angles = []
+		distances = []
+		# Unit direction to each as well, for testing it against a wall
+		directions = []
+		ends = wallEnds(grid.walls, walls, x, y, clip)
+		for angle, distance, px, py in sorted((math.atan2(py - y, px - x), math.hypot(px - x, py - y), px, py) for px, py in ends):
+			if not self.angles or angle != self.angles[-1]:
+				self.angles.append(angle)
+				distances.append(distance)
+				if distance > 0:
+					directions.append(((px - x) / distance, (py - y) / distance))
+				else:
+					directions.append((math.cos(angle), math.sin(angle)))
+		store = grid.walls
+		count = len(self.angles)
+		self.gaps = [-1] * count
+		k = 0
+		while k < count:
+			if k + 1 < count:
+				last = self.angles[k + 1]
+			else:
+				last = self.angles[0] + 2 * math.pi
+			hit, wall = grid.nearest(rays.angleRay(x, y, (self.angles[k] + last) / 2, clip))
+			self.gaps[k] = wall
+			k += 1
+			while wall >= 0 and k < count:
+				cosAngle, sinAngle = directions[k]
+				t = wallDistance(store, wall, x, y, cosAngle, sinAngle)
+				if t is None or t + BEHIND >= distances[k]:
+					break
+				self.gaps[k] = wall
+				k += 1
+		self.walls = set(wall for wall in self.gaps if wall >= 0)
+		# True if some direction has no wall within clip, the only way
+		# anything further away can be seen
+		self.open = not self.gaps or -1 in self.gaps
+
+	def sees(self, tx, ty):
+		# True if nothing blocks the line of sight to (tx, ty), found from
+		# the wall of the gap it lies in. Sprites are drawn past the clip
+		# distance, so those further away with no wall before the clip are
+		# traced instead.
+		x = self.x
+		y = self.y
+		distance = math.hypot(tx - x, ty - y)
+		if distance == 0:
+			return 1
+		if not self.angles:
+			return distance < self.clip or lineOfSight(self.grid, x, y, tx, ty)
+		angle = math.atan2(ty - y, tx - x)
+		k = bisect.bisect_right(self.angles, angle) - 1
+		if self.angles[k] == angle:
+			# Right on an end point, where the nearest wall changes
+			return lineOfSight(self.grid, x, y, tx, ty)
+		wall = self.gaps[k]
+		if wall < 0:
+			return distance < self.clip or lineOfSight(self.grid, x, y, tx, ty)
+		t = wallDistance(self.grid.walls, wall, x, y, (tx - x) / distance, (ty - y) / distance)
+		return t is None or t >= distance
+
+def wallDistance(store, i, x, y, cosAngle, sinAngle):
+	# Distance from (x, y) along a unit direction to wall i of a WallStore,
+	# or None if the ray misses it, solved as in WallStore.hit
+	dx = store.dx[i]
+	dy = store.dy[i]
+	denom = cosAngle * dy - sinAngle * dx
+	if denom == 0:
+		return None
+	ax = store.x1[i] - x
+	ay = store.y1[i] - y
+	t = (ax * dy - ay * dx) / denom
+	s = (ax * sinAngle - ay * cosAngle) / denom
+	if t <= 0 or s < 0 or s > 1:
+		return None
+	return t
+
+def regionSet(grid, triangles, sprites, spacing = 0.5, clip = CLIP):
+	# Sorted wall and sprite indices visible from any sample point of the
+	# region within clip. sprites are (x, y) positions.
+	walls = set()
+	seen = set()
+	for triangle in triangles:
+		# Walls, and sprites, within clip of any point of the triangle
+		xs = triangle[0::2]
+		ys = triangle[1::2]
+		minX = min(xs) - clip
+		minY = min(ys) - clip
+		maxX = max(xs) + clip
+		maxY = max(ys) + clip
+		near = grid.wallsIn(minX, minY, maxX, maxY)
+		nearSprites = [k for k, (sx, sy) in enumerate(sprites) if minX - SPRITE_REACH <= sx <= maxX + SPRITE_REACH and minY - SPRITE_REACH <= sy <= maxY + SPRITE_REACH]
+		for x, y in samplePoints(triangle, spacing):
+			view = PointView(grid, x, y, near, clip)
+			walls |= view.walls
+			# Sprites further than clip are behind a wall unless the view
+			# is open somewhere
+			candidates = nearSprites
+			if view.open:
+				candidates = range(len(sprites))
+			for k in candidates:
+				if k in seen:
+					continue
+				sx, sy = sprites[k]
+				for tx, ty in ((sx, sy), (sx - SPRITE_REACH, sy), (sx + SPRITE_REACH, sy), (sx, sy - SPRITE_REACH), (sx, sy + SPRITE_REACH)):
+					if view.sees(tx, ty):
+						seen.add(k)
+						break
+	return sorted(walls), sorted(seen)
+
+def computeSets(grid, regions, sprites, spacing = 0.5, clip = CLIP):
+	# (walls, sprites) per region, regions given as lists of triangles
+	return [regionSet(grid, triangles, sprites, spacing, clip) for triangles in regions]
@@ -0,0 +1,257 @@
+# Uniform grid spatial index over the walls of a WallStore
+# Rays step through it cell by cell with a DDA walk
+
+import math
+import rays
+import wallStore
+
+EPSILON = 1e-9
+
+class WallGrid:
+	# Each cell lists the indices of the walls that overlap it. Cells are
+	# stored in a flat list, row by row, starting from the bottom left
+	# corner of the map.
+	def __init__(self, walls, cellSize = 1.0):
+		self.walls = walls
+		self.cellSize = float(cellSize)
+		# Walls tested by trace since the counter was last reset
+		self.tested = 0
+		if len(walls) == 0:
+			self.minX = self.minY = 0.0
+			self.width = self.height = 1
+		else:
+			x2 = [x1 + dx for x1, dx in zip(walls.x1, walls.dx)]
+			y2 = [y1 + dy for y1, dy in zip(walls.y1, walls.dy)]
+			self.minX = min(min(walls.x1), min(x2))
+			self.minY = min(min(walls.y1), min(y2))
+			maxX = max(max(walls.x1), max(x2))
+			maxY = max(max(walls.y1), max(y2))
+			self.width = int(math.floor((maxX - self.minX) / self.cellSize)) + 1
+			self.height = int(math.floor((maxY - self.minY) / self.cellSize)) + 1
+		self.cells = [[] for i in range(self.width * self.height)]
+		for i in range(len(walls)):
+			self.insert(i)
+
+	def cellRange(self, i):
+		# Cells covered by wall i's bounding box, padded so walls lying on
+		# a cell boundary are listed on both sides of it
+		size = self.cellSize
+		x1 = self.walls.x1[i]
+		y1 = self.walls.y1[i]
+		x2 = x1 + self.walls.dx[i]
+		y2 = y1 + self.walls.dy[i]
+		cx0 = max(0, int(math.floor((min(x1, x2) - self.minX - EPSILON) / size)))
+		cy0 = max(0, int(math.floor((min(y1, y2) - self.minY - EPSILON) / size)))
+		cx1 = min(self.width - 1, int(math.floor((max(x1, x2) - self.minX + EPSILON) / size)))
+		cy1 = min(self.height - 1, int(math.floor((max(y1, y2) - self.minY + EPSILON) / size)))
+		return cx0, cy0, cx1, cy1
+
+	def overlaps(self, i, cx, cy):
+		# True unless all four cell corners lie strictly on one side of wall i
+		x1 = self.walls.x1[i]
+		y1 = self.walls.y1[i]
+		dx = self.walls.dx[i]
+		dy = self.walls.dy[i]
+		tolerance = EPSILON * (abs(dx) + abs(dy) + 1)
+		left = 0
+		right = 0
+		for corner in ((0, 0), (1, 0), (0, 1), (1, 1)):
+			x = self.minX + (cx + corner[0]) * self.cellSize
+			y = self.minY + (cy + corner[1]) * self.cellSize
+			side = dx * (y - y1) - dy * (x - x1)
+			if side > tolerance:
+				left = 1
+			elif side < -tolerance:
+				right = 1
+			else:
+				return 1
+		return left and right
+
+	def insert(self, i):
+		# Add wall i, already in self.walls, to the cells it overlaps
+		x0, y0, x1, y1 = self.cellRange(i)
+		for cy in range(y0, y1 + 1):
+			for cx in range(x0, x1 + 1):
+				if self.overlaps(i, cx, cy):
+					self.cells[cy * self.width + cx].append(i)
+
+	def remove(self, i):
+		x0, y0, x1, y1 = self.cellRange(i)
+		for cy in range(y0, y1 + 1):
+			for cx in range(x0, x1 + 1):
+				cell = self.cells[cy * self.width + cx]
+				if i in cell:
+					cell.remove(i)
+
+	def wallsIn(self, minX, minY, maxX, maxY):
+		# Sorted indices of the walls listed in the cells that overlap the
+		# box, which includes every wall that enters it
+		size = self.cellSize
+		cx0 = max(0, int(math.floor((minX - self.minX) / size)))
+		cy0 = max(0, int(math.floor((minY - self.minY) / size)))
+		cx1 = min(self.width - 1, int(math.floor((maxX - self.minX) / size)))
+		cy1 = min(self.height - 1, int(math.floor((maxY - self.minY) / size)))
+		walls = set()
+		for cy in range(cy0, cy1 + 1):
+			for cx in range(cx0, cx1 + 1):
+				walls.update(self.cells[cy * self.width + cx])
+		return sorted(walls)
+
+	def move(self, i, line):
+		# Give wall i line's position and texture. Only the cells it
+		# covered and now covers are touched.
+		self.remove(i)
+		self.walls.set(i, line)
+		self.insert(i)
+
+	def entry(self, x, y, cosAngle, sinAngle, maxT):
+		# Distance along the ray at which it enters the grid bounds, or None
+		tNear = 0.0
+		tFar = maxT
+		bounds = ((x, cosAngle, self.minX, self.minX + self.width * self.cellSize), (y, sinAngle, self.minY, self.minY + self.height * self.cellSize))
+		for origin, direction, low, high in bounds:
+			if direction == 0:
+				if origin < low or origin > high:
+					return None
+			else:
+				t0 = (low - origin) / direction
+				t1 = (high - origin) / direction
+				if t0 > t1:
+					t0, t1 = t1, t0
+				tNear = max(tNear, t0)
+				tFar = min(tFar, t1)
+		if tNear > tFar:
+			return None
+		return tNear
+
+	def walk(self, x, y, cosAngle, sinAngle, maxT):
+		# Yields (cell, tEnter, tExit) for every cell the ray passes through
+		# until it leaves the grid or travels maxT
+		t = self.entry(x, y, cosAngle, sinAngle, maxT)
+		if t is None:
+			return
+		size = self.cellSize
+		px = x + cosAngle * t - self.minX
+		py = y + sinAngle * t - self.minY
+		cx = min(self.width - 1, max(0, int(math.floor(px / size))))
+		cy = min(self.height - 1, max(0, int(math.floor(py / size))))
+
+		if cosAngle > 0:
+			stepX = 1
+			tMaxX = t + ((cx + 1) * size - px) / cosAngle
+			tDeltaX = size / cosAngle
+		elif cosAngle < 0:
+			stepX = -1
+			tMaxX = t + (cx * size - px) / cosAngle
+			tDeltaX = -size / cosAngle
+		else:
+			stepX = 0
+			tMaxX = tDeltaX = float("inf")
+		if sinAngle > 0:
+			stepY = 1
+			tMaxY = t + ((cy + 1) * size - py) / sinAngle
+			tDeltaY = size / sinAngle
+		elif sinAngle < 0:
+			stepY = -1
+			tMaxY = t + (cy * size - py) / sinAngle
+			tDeltaY = -size / sinAngle
+		else:
+			stepY = 0
+			tMaxY = tDeltaY = float("inf")
+
+		while t <= maxT:
+			tExit = min(tMaxX, tMaxY)
+			yield self.cells[cy * self.width + cx], t, tExit
+			t = tExit
+			if tMaxX < tMaxY:
+				cx += stepX
+				tMaxX += tDeltaX
+				if cx < 0 or cx >= self.width:
+					return
+			else:
+				cy += stepY
+				tMaxY += tDeltaY
+				if cy < 0 or cy >= self.height:
+					return
+
+	def trace(self, ray):
+		# Nearest hit along a rays.Ray as (distance, texture, texVert, x, y),
+		# or None. Player.clip (ray.clip) bounds the walk.
+		return self.nearest(ray)[0]
+
+	def nearest(self, ray):
+		# (hit, wall index) of the nearest hit, or (None, -1)
+		nearest = None
+		wall = -1
+		seen = set()
+		tested = 0
+		walls = self.walls
+		for cell, tEnter, tExit in self.walk(ray.x, ray.y, ray.cosAngle, ray.sinAngle, ray.clip):
+			for i in cell:
+				if i in seen:
+					continue
+				seen.add(i)
+				tested += 1
+				hit = walls.hit(i, ray)
+				if hit is not None and (nearest is None or hit[0] < nearest[0]):
+					nearest = hit
+					wall = i
+			if nearest is not None and nearest[0] <= tExit + EPSILON:
+				break
+		self.tested += tested
+		return nearest, wall
+
+	def castRay(self, x, y, angle, clip):
+		# Ray query for code outside the renderer
+		return self.trace(rays.angleRay(x, y, angle, clip))
+
+def fromCells(walls, cellSize, minX, minY, width, height, offsets, indices):
+	# WallGrid with the cells of a compiled map, given as offsets into a flat
+	# sequence of indices into walls, instead of placing every wall again
+	grid = WallGrid(wallStore.WallStore(()), cellSize)
+	grid.walls = walls
+	grid.minX = minX
+	grid.minY = minY
+	grid.width = width
+	grid.height = height
+	grid.cells = [indices[offsets[i]:offsets[i + 1]] for i in range(width * height)]
+	return grid
+
+class GridCaster:
+	# Wall engine that traces each column through a WallGrid
+	def __init__(self, walls, cellSize = 1.0, grid = None):
+		# Column tables of the last cast
+		self.tables = None
+		# Rays cast and walls tested by the last cast
+		self.rays = 0
+		self.tested = 0
+		if grid is None:
+			grid = WallGrid(walls, cellSize)
+		self.grid = grid
+
+	def setVisible(self, visible):
+		# Traces only reach walls near each ray already, so a visible set
+		# would not save any tests
+		pass
+
+	def moveWall(self, i, line):
+		self.grid.move(i, line)
+
+	def cast(self, player, resWidth, screenWidth):
+		return self.castRange(player, resWidth, screenWidth, 0, resWidth)
+
+	def castRange(self, player, resWidth, screenWidth, first, last):
+		# Columns first to last - 1 only
+		screenLineIndex = []
+		self.grid.tested = 0
+		self.rays = int(last - first)
+		tables = self.tables = rays.columnTables(self.tables, player, resWidth, screenWidth)
+		xs, ys = tables.directions(player, first, last)
+		for divCount, dirX, dirY in zip(range(first, last), xs, ys):
+			hit = self.grid.trace(rays.Ray(player.x, player.y, dirX, dirY, player.clip))
+			if hit is not None:
+				rectHeight = tables.height(divCount, hit[0])
+				screenLineIndex.append((hit[0], hit[1], rectHeight, divCount, hit[2]))
+
+		self.tested = self.grid.tested
+		return screenLineIndex
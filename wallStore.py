@@ -0,0 +1,76 @@
+# Compact wall store
+# Holds every wall as one row of typed arrays built once at map load, and
+# solves ray hits in parametric form, wall = (x1, y1) + s * (dx, dy)
+
+import math
+from array import array
+
+class WallStore:
+	# Row i of every array is wall i of the lines it was built from
+	def __init__(self, lines):
+		self.x1 = array("d")
+		self.y1 = array("d")
+		# Direction from the first end point to the second
+		self.dx = array("d")
+		self.dy = array("d")
+		# Texture repeats across the wall and texture index
+		self.tile = array("d")
+		self.texture = array("i")
+		for line in lines:
+			self.append(line)
+
+	def __len__(self):
+		return len(self.texture)
+
+	def append(self, line):
+		self.x1.append(line.x1)
+		self.y1.append(line.y1)
+		self.dx.append(line.x2 - line.x1)
+		self.dy.append(line.y2 - line.y1)
+		self.tile.append(line.tTexture)
+		self.texture.append(int(line.texture))
+
+	def set(self, i, line):
+		# Refresh row i after the wall moved or changed texture
+		self.x1[i] = line.x1
+		self.y1[i] = line.y1
+		self.dx[i] = line.x2 - line.x1
+		self.dy[i] = line.y2 - line.y1
+		self.tile[i] = line.tTexture
+		self.texture[i] = int(line.texture)
+
+	def hit(self, i, ray):
+		# Returns (distance, texture, texVert, x, y) for wall i or None if the
+		# wall is missed, parallel, behind the ray or past the clip distance.
+		# The ray direction is a unit vector, so t is the distance and s the
+		# fraction of the way along the wall.
+		dx = self.dx[i]
+		dy = self.dy[i]
+		denom = ray.cosAngle * dy - ray.sinAngle * dx
+		if denom == 0:
+			return None
+		ax = self.x1[i] - ray.x
+		ay = self.y1[i] - ray.y
+		t = (ax * dy - ay * dx) / denom
+		if t <= 0 or t >= ray.clip:
+			return None
+		s = (ax * ray.sinAngle - ay * ray.cosAngle) / denom
+		if s < 0 or s > 1:
+			return None
+		texVert = (1 - s) * self.tile[i]
+		if texVert > 1:
+			texVert -= math.ceil(texVert) - 1
+		return (t, self.texture[i], texVert, ray.x + ray.cosAngle * t, ray.y + ray.sinAngle * t)
+
+def fromRecords(records, fields = 6):
+	# Store built straight from flat (x1, y1, x2, y2, texture, tile) records,
+	# e.g. a typed view of a compiled map's wall section, without a line
+	# object per wall
+	walls = WallStore(())
+	walls.x1 = array("d", records[0::fields])
+	walls.y1 = array("d", records[1::fields])
+	walls.dx = array("d", [x2 - x1 for x1, x2 in zip(walls.x1, records[2::fields])])
+	walls.dy = array("d", [y2 - y1 for y1, y2 in zip(walls.y1, records[3::fields])])
+	walls.texture = array("i", [int(texture) for texture in records[4::fields]])
+	walls.tile = array("d", records[5::fields])
+	return walls